@@ -1,26 +1,339 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Generator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED = ".zst"
+DICT_DIR = ".dicts"
+DICT_SIZE = 16384
+LEVEL = 10
+LOCK = ".lock"
+META = ".meta.json"
+STATS = ".stats.json"
+
+# only used where there's no fcntl, so only works within one process
+fallback_lock = threading.Lock()
+
+
+class CacheException(Exception):
+    pass
+
+
+@dataclass
+class CacheEntry:
+    """Metadata for one cached response. Entries written before metadata was
+    recorded get their times from the file."""
+
+    case_id: str
+    filename: str
+    size: int
+    created: float
+    accessed: float
+    model: str = None
+    prompt_hash: str = None
+
+
+@contextmanager
+def locked(directory: Path):
+    """Hold an exclusive lock on a directory, for read-modify-write updates to
+    the JSON files in it which may be made by several threads or workers at
+    once. The lock is the directory's lock file, so it works across processes
+    as well as threads."""
+    directory.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with fallback_lock:
+            yield
+        return
+    with open(directory / LOCK, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def write_json(path: Path, data):
+    """Write a JSON file atomically, so that readers never see it half
+    written"""
+    temp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}")
+    with open(temp, "w") as fh:
+        json.dump(data, fh)
+    os.replace(temp, path)
 
 
 class Cache:
-    def __init__(self, root):
+    """The cache is a directory for each case with a file for each prompt.
+    If compress is set, entries are written with zstd, using a dictionary per
+    prompt if one has been trained by compact(). Compressed entries are read
+    transparently whether or not compress is set."""
+
+    def __init__(self, root, compress: bool = False):
         self.root = root
+        self.compress = compress
+        if compress and zstandard is None:
+            raise CacheException("Compressing the cache needs zstandard installed")
+        self.dicts = {}
+        self.hits = 0
+        self.misses = 0
+        self.accessed = {}
+
+    def write(self, case_id, filename, results, model=None, prompt_hash=None):
+        """Write an entry and record its metadata"""
+        self.store(case_id, filename, results)
+        now = time.time()
+        with locked(Path(self.root) / Path(case_id)):
+            meta = self.metadata(case_id)
+            meta[filename] = {
+                "created": now,
+                "accessed": now,
+                "model": model,
+                "prompt_hash": prompt_hash,
+            }
+            self.write_metadata(case_id, meta)
 
-    def write(self, case_id, filename, results):
+    def store(self, case_id, filename, results):
+        """Write an entry without touching its metadata"""
         cache_dir = Path(self.root) / Path(case_id)
         cache_dir.mkdir(parents=True, exist_ok=True)
         cache_file = cache_dir / Path(filename)
-        with open(cache_file, "w") as fh:
-            fh.write(results)
+        compressed_file = cache_dir / Path(filename + COMPRESSED)
+        if self.compress:
+            with open(compressed_file, "wb") as fh:
+                fh.write(self.compressor(filename).compress(results.encode("utf-8")))
+            cache_file.unlink(missing_ok=True)
+        else:
+            with open(cache_file, "w") as fh:
+                fh.write(results)
+            compressed_file.unlink(missing_ok=True)
 
     def read(self, case_id, filename):
+        results = self.load(case_id, filename)
+        if results is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.accessed[(case_id, filename)] = time.time()
+        return results
+
+    def load(self, case_id, filename):
+        """Read an entry without counting it as a hit or a miss"""
         cache_file = Path(self.root) / Path(case_id) / Path(filename)
         if cache_file.is_file():
             with open(cache_file, "r") as fh:
                 results = fh.read()
                 return results
+        compressed_file = cache_file.with_name(filename + COMPRESSED)
+        if compressed_file.is_file():
+            with open(compressed_file, "rb") as fh:
+                return self.decompress(filename, fh.read())
         else:
             return None
 
+    def delete(self, case_id, filename):
+        """Remove an entry and its metadata, and the case directory if that
+        was the last entry"""
+        cache_dir = Path(self.root) / Path(case_id)
+        (cache_dir / Path(filename)).unlink(missing_ok=True)
+        (cache_dir / Path(filename + COMPRESSED)).unlink(missing_ok=True)
+        with locked(cache_dir):
+            meta = self.metadata(case_id)
+            if filename in meta:
+                del meta[filename]
+                self.write_metadata(case_id, meta)
+        if not self.entries(case_id):
+            # the metadata and its lock file
+            for path in cache_dir.iterdir():
+                if path.is_file():
+                    path.unlink()
+            cache_dir.rmdir()
+
+    def metadata(self, case_id) -> dict:
+        meta_file = Path(self.root) / Path(case_id) / META
+        if meta_file.is_file():
+            with open(meta_file, "r") as fh:
+                return json.load(fh)
+        return {}
+
+    def write_metadata(self, case_id, meta: dict):
+        """Replace a case's metadata. Callers should hold locked() on the case
+        directory while they read, change and write it."""
+        write_json(Path(self.root) / Path(case_id) / META, meta)
+
+    def entry_info(self, case_id) -> list[CacheEntry]:
+        """Returns a CacheEntry for every entry in a case"""
+        cache_dir = Path(self.root) / Path(case_id)
+        meta = self.metadata(case_id)
+        infos = []
+        for filename in self.entries(case_id):
+            cache_file = cache_dir / Path(filename)
+            if not cache_file.is_file():
+                cache_file = cache_dir / Path(filename + COMPRESSED)
+            stat = cache_file.stat()
+            m = meta.get(filename, {})
+            infos.append(
+                CacheEntry(
+                    case_id=case_id,
+                    filename=filename,
+                    size=stat.st_size,
+                    created=m.get("created", stat.st_mtime),
+                    accessed=m.get("accessed", stat.st_mtime),
+                    model=m.get("model"),
+                    prompt_hash=m.get("prompt_hash"),
+                )
+            )
+        return infos
+
+    def fingerprint(self, case_id, filenames) -> list:
+        """Returns the modification time and size of each of the named
+        entries (None for missing ones), to tell whether they have changed
+        without reading them"""
+        cache_dir = Path(self.root) / Path(case_id)
+        fingerprint = []
+        for filename in filenames:
+            stat = None
+            for name in (filename, filename + COMPRESSED):
+                cache_file = cache_dir / Path(name)
+                if cache_file.is_file():
+                    st = cache_file.stat()
+                    stat = [name, st.st_mtime_ns, st.st_size]
+                    break
+            fingerprint.append(stat)
+        return fingerprint
+
+    def flush(self):
+        """Save the access times of entries read since the last flush, which
+        are used for LRU eviction, and add the hit and miss counts to the
+        running totals"""
+        by_case = {}
+        for (case_id, filename), accessed in self.accessed.items():
+            by_case.setdefault(case_id, {})[filename] = accessed
+        for case_id, accesses in by_case.items():
+            with locked(Path(self.root) / Path(case_id)):
+                meta = self.metadata(case_id)
+                for filename, accessed in accesses.items():
+                    if filename in meta:
+                        meta[filename]["accessed"] = accessed
+                if meta:
+                    self.write_metadata(case_id, meta)
+        with locked(Path(self.root)):
+            stats = self.stats()
+            stats["hits"] += self.hits
+            stats["misses"] += self.misses
+            write_json(Path(self.root) / STATS, stats)
+        self.hits = 0
+        self.misses = 0
+        self.accessed = {}
+
+    def stats(self) -> dict[str, int]:
+        """Returns the total hits and misses saved by flush()"""
+        stats_file = Path(self.root) / STATS
+        if stats_file.is_file():
+            with open(stats_file, "r") as fh:
+                return json.load(fh)
+        return {"hits": 0, "misses": 0}
+
     def exists(self, case_id):
         cache_dir = Path(self.root) / Path(case_id)
         return cache_dir.exists()
+
+    def case_ids(self) -> Generator[str, None, None]:
+        """Yields the ID of every case in the cache"""
+        for item in Path(self.root).glob("*"):
+            if item.is_dir() and not item.name.startswith("."):
+                yield item.name
+
+    def entries(self, case_id) -> list[str]:
+        """Returns the names of the entries for a case"""
+        cache_dir = Path(self.root) / Path(case_id)
+        return sorted(
+            item.name.removesuffix(COMPRESSED)
+            for item in cache_dir.glob("*")
+            if item.is_file() and not item.name.startswith(".")
+        )
+
+    def dict_file(self, filename) -> Path:
+        return Path(self.root) / DICT_DIR / Path(filename + ".dict")
+
+    def dictionary(self, filename):
+        """Returns the trained dictionary for a prompt, or None"""
+        if filename not in self.dicts:
+            self.dicts[filename] = None
+            dict_file = self.dict_file(filename)
+            if dict_file.is_file():
+                self.dicts[filename] = zstandard.ZstdCompressionDict(
+                    dict_file.read_bytes()
+                )
+        return self.dicts[filename]
+
+    def compressor(self, filename):
+        return zstandard.ZstdCompressor(
+            level=LEVEL, dict_data=self.dictionary(filename)
+        )
+
+    def decompress(self, filename, data: bytes) -> str:
+        if zstandard is None:
+            raise CacheException("Reading compressed entries needs zstandard")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dictionary = None
+        if dict_id:
+            dictionary = self.dictionary(filename)
+            if dictionary is None or dictionary.dict_id() != dict_id:
+                raise CacheException(f"Missing dictionary for {filename}")
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor.decompress(data).decode("utf-8")
+
+    def size(self) -> int:
+        """Total size in bytes of everything in the cache"""
+        return sum(f.stat().st_size for f in Path(self.root).rglob("*") if f.is_file())
+
+    def compact(self, dict_size: int = DICT_SIZE) -> dict[str, int]:
+        """Trains a dictionary for each prompt from the existing entries and
+        rewrites all of the entries compressed with it. Responses to the same
+        prompt share most of their JSON keys and boilerplate, so they compress
+        far better with a dictionary than on their own. Prompts with too few
+        entries to train a dictionary are compressed without one.
+
+        Returns the number of entries rewritten for each prompt."""
+        if zstandard is None:
+            raise CacheException("Compacting the cache needs zstandard installed")
+        by_prompt = {}
+        for case_id in self.case_ids():
+            for filename in self.entries(case_id):
+                by_prompt.setdefault(filename, []).append(case_id)
+        compacted = {}
+        for filename, case_ids in by_prompt.items():
+            # read everything before replacing the dictionary, which would
+            # make entries compressed with the old one unreadable
+            responses = {c: self.load(c, filename) for c in case_ids}
+            samples = [r.encode("utf-8") for r in responses.values()]
+            dict_file = self.dict_file(filename)
+            dict_file.unlink(missing_ok=True)
+            self.dicts[filename] = None
+            try:
+                trained = zstandard.train_dictionary(dict_size, samples)
+                dict_file.parent.mkdir(parents=True, exist_ok=True)
+                dict_file.write_bytes(trained.as_bytes())
+                self.dicts[filename] = trained
+            except zstandard.ZstdError:
+                pass
+            compress = self.compress
+            self.compress = True
+            for case_id, response in responses.items():
+                self.store(case_id, filename, response)
+            self.compress = compress
+            compacted[filename] = len(responses)
+        return compacted
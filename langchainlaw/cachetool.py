@@ -0,0 +1,213 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+from langchainlaw.cache import Cache, CacheEntry, DICT_SIZE
+from langchainlaw.classifier import Classifier, SAMPLES
+from langchainlaw.collate import MAX_RE
+from langchainlaw.preprocess import preprocess_casefiles
+from langchainlaw.prompts import parse_llm_json
+
+DAY = 24 * 60 * 60
+
+
+def compact(cache: Cache, dict_size: int = DICT_SIZE):
+    """Compress every entry in the cache with a dictionary for each prompt"""
+    before = cache.size()
+    compacted = cache.compact(dict_size)
+    after = cache.size()
+    for filename, n in sorted(compacted.items()):
+        print(f"{filename}: {n} entries")
+    print(f"Compacted {cache.root} from {before} to {after} bytes")
+
+
+def prompt_name(filename: str) -> str:
+    """The prompt an entry belongs to, including the samples for a prompt"""
+    return filename.removesuffix(SAMPLES)
+
+
+def is_error(cache: Cache, entry: CacheEntry, return_types: dict[str, str]) -> bool:
+    """An entry is an error if it's empty, if the LLM complained about the
+    context length, or if it should be JSON and can't be parsed"""
+    response = cache.load(entry.case_id, entry.filename)
+    if not response or not response.strip() or MAX_RE.search(response):
+        return True
+    if entry.filename.endswith(SAMPLES):
+        return False
+    if return_types.get(entry.filename, "text") != "text":
+        try:
+            parse_llm_json(response)
+        except Exception:
+            return True
+    return False
+
+
+def select_garbage(
+    cache: Cache,
+    ttl: float = None,
+    max_size: int = None,
+    prompts: list[str] = None,
+    errors: bool = False,
+    return_types: dict[str, str] = None,
+) -> list[CacheEntry]:
+    """Returns the entries to be removed by garbage collection.
+
+    ttl: remove entries created more than this many seconds ago
+    prompts: remove entries for prompts which aren't in this list
+    errors: remove empty and context length responses, and responses which
+    can't be parsed if their prompt is in return_types and expects JSON
+    max_size: then remove the least recently used entries until the cache is
+    no bigger than this many bytes"""
+    now = time.time()
+    entries = [e for c in cache.case_ids() for e in cache.entry_info(c)]
+    garbage = []
+    keep = []
+    for entry in entries:
+        if ttl is not None and now - entry.created > ttl:
+            garbage.append(entry)
+        elif prompts is not None and prompt_name(entry.filename) not in prompts:
+            garbage.append(entry)
+        elif errors and is_error(cache, entry, return_types or {}):
+            garbage.append(entry)
+        else:
+            keep.append(entry)
+    if max_size is not None:
+        size = sum(e.size for e in keep)
+        for entry in sorted(keep, key=lambda e: e.accessed):
+            if size <= max_size:
+                break
+            garbage.append(entry)
+            size -= entry.size
+    return garbage
+
+
+def gc(cache: Cache, garbage: list[CacheEntry], dry_run: bool = False):
+    for entry in garbage:
+        print(f"{entry.case_id}/{entry.filename} ({entry.size} bytes)")
+        if not dry_run:
+            cache.delete(entry.case_id, entry.filename)
+    freed = sum(e.size for e in garbage)
+    verb = "Would remove" if dry_run else "Removed"
+    print(f"{verb} {len(garbage)} entries, {freed} bytes")
+
+
+def stats(cache: Cache):
+    """Print the disk usage of the cache by prompt and model, and the hit rate"""
+    entries = [e for c in cache.case_ids() for e in cache.entry_info(c)]
+    cases = len({e.case_id for e in entries})
+    print(f"{cases} cases, {len(entries)} entries, {cache.size()} bytes on disk")
+    for label, key in [("prompt", "filename"), ("model", "model")]:
+        totals = {}
+        for e in entries:
+            n, size = totals.get(getattr(e, key), (0, 0))
+            totals[getattr(e, key)] = (n + 1, size + e.size)
+        print(f"By {label}:")
+        for name, (n, size) in sorted(totals.items(), key=lambda t: str(t[0])):
+            print(f"  {name}: {n} entries, {size} bytes")
+    counts = cache.stats()
+    total = counts["hits"] + counts["misses"]
+    if total:
+        rate = counts["hits"] / total
+        print(f"Hit rate: {rate:.1%} ({counts['hits']} of {total} lookups)")
+
+
+def preprocess(cache: Cache, config: dict):
+    """Build the preprocessed text of every casefile in the input directory"""
+    casefiles = sorted(Path(config["input"]).glob("*.json"))
+    field = config.get("judgment_field", "judgment")
+    counts = preprocess_casefiles(cache, casefiles, field)
+    print(f"Built {counts['built']}, reused {counts['reused']} preprocessed cases")
+    if counts["json_chars"]:
+        saved = 1 - counts["text_chars"] / counts["json_chars"]
+        print(
+            f"{counts['text_chars']} characters of text for"
+            f" {counts['json_chars']} of JSON ({saved:.1%} smaller)"
+        )
+
+
+def cli():
+    ap = argparse.ArgumentParser("cache")
+    ap.add_argument(
+        "--config",
+        default="./config.json",
+        type=Path,
+        help="Config file",
+    )
+    ap.add_argument(
+        "--cache",
+        default=None,
+        type=str,
+        help="Cache directory (overrides the config)",
+    )
+    sub = ap.add_subparsers(dest="command", required=True)
+    compact_ap = sub.add_parser("compact", help="Compress the cache with zstd")
+    compact_ap.add_argument(
+        "--dict-size",
+        default=DICT_SIZE,
+        type=int,
+        help="Size in bytes of the dictionary trained for each prompt",
+    )
+    gc_ap = sub.add_parser("gc", help="Remove old, unused or failed entries")
+    gc_ap.add_argument(
+        "--ttl", default=None, type=float, help="Remove entries older than N days"
+    )
+    gc_ap.add_argument(
+        "--max-size",
+        default=None,
+        type=int,
+        help="Remove least recently used entries until the cache fits in N bytes",
+    )
+    gc_ap.add_argument(
+        "--stale-prompts",
+        action="store_true",
+        default=False,
+        help="Remove entries for prompts which aren't in the prompts spreadsheet",
+    )
+    gc_ap.add_argument(
+        "--errors",
+        action="store_true",
+        default=False,
+        help="Remove empty, context length and unparseable responses",
+    )
+    gc_ap.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="List what would be removed without removing it",
+    )
+    sub.add_parser("stats", help="Show disk usage and hit rate")
+    sub.add_parser(
+        "preprocess", help="Build the compact text of every case in the input"
+    )
+    args = ap.parse_args()
+
+    config = None
+    if args.cache is None or args.command in ("gc", "preprocess"):
+        with open(args.config, "r") as cfh:
+            config = json.load(cfh)
+    cache = Cache(args.cache or config["cache"])
+
+    if args.command == "compact":
+        compact(cache, args.dict_size)
+    elif args.command == "gc":
+        classifier = Classifier(config, quiet=True)
+        classifier.load_prompts(config["prompts"])
+        return_types = {n: p.return_type for n, p in classifier.prompts.items()}
+        garbage = select_garbage(
+            cache,
+            ttl=args.ttl * DAY if args.ttl is not None else None,
+            max_size=args.max_size,
+            prompts=classifier.prompt_names if args.stale_prompts else None,
+            errors=args.errors,
+            return_types=return_types,
+        )
+        gc(cache, garbage, args.dry_run)
+    elif args.command == "stats":
+        stats(cache)
+    elif args.command == "preprocess":
+        preprocess(cache, config)
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,20 +1,59 @@
+import copy
 import json
-import time
+import random
 import sys
+import threading
+import time
 import pandas as pd
 
-from typing import Generator
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Generator, Iterable
 from pathlib import Path
 
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
 from langchainlaw.prompts import CasePrompt, CasePromptField, PromptException
+from langchainlaw.providers import ChatResponse, Provider, is_transient, make_provider
 from langchainlaw.cache import Cache
+from langchainlaw.excerpt import JudgmentIndex
+from langchainlaw.hedging import (
+    DeadlineExceeded,
+    LatencyTracker,
+    first_valid,
+    run_in_thread,
+)
+from langchainlaw.judgments import JUDGMENT_CACHE_MB, JudgmentCache, read_casefile
+from langchainlaw.preprocess import (
+    compact_text,
+    load_artifact,
+    number_paragraphs,
+    save_artifact,
+)
+from langchainlaw.ratelimit import RateLimiter
 
 from langchainlaw.prompts import ResultsDict, FlatResultsDict
 
 RATE_LIMIT = 60
+RETRIES = 3
+RETRY_BACKOFF = 1.0
+CONTINUATIONS = 1
+CONTINUE = (
+    "Your answer was cut off. Continue it from exactly where it stopped,"
+    " without repeating anything."
+)
+SAMPLES = ".samples"
+AGREEMENT = "agreement"
+
+
+def case_id_for(judgment: dict) -> str:
+    """The case ID for a judgment: its "id" if it has one, or else the last
+    part of its URI, which is the ID the casefiles are named by"""
+    if "id" in judgment:
+        return str(judgment["id"])
+    if judgment.get("uri"):
+        return judgment["uri"].rstrip("/").split("/")[-1]
+    raise PromptException("Can't find a case ID for judgment")
 
 
 class Classifier:
@@ -24,8 +63,9 @@ class Classifier:
     def __init__(self, config: dict[str, str | dict], quiet: bool = False):
         self.provider = config["provider"]
         self.spreadsheet = config["prompts"]
+        self.providers_cf = config["providers"]
         try:
-            self.api_cf = config["providers"][self.provider]
+            self.api_cf = self.providers_cf[self.provider]
         except KeyError:
             print(f"Unknown provider: {self.provider}")
             sys.exit(-1)
@@ -35,26 +75,51 @@ class Classifier:
         self._judgment = None
         self._prompt_judgment = None
         self.judgment_template = None
+        self.judgment_field = config.get("judgment_field", "judgment")
+        self._index = None
+        self._judgment_message = None
+        self.split_judgment = config.get("split_judgment", False)
+        self.preprocess = config.get("preprocess", False)
+        cache_mb = config.get("judgment_cache_mb", JUDGMENT_CACHE_MB)
+        self.judgments = JudgmentCache(cache_mb * 1024 * 1024)
         self.test = False
         self.headers = None
         self.quiet = quiet
-        self.chat = ChatOpenAI(
-            model_name=self.api_cf["model"],
-            openai_api_key=self.api_cf["api_key"],
-            openai_organization=self.api_cf["organization"],
-            temperature=config["temperature"],
-        )
+        self.temperature = config["temperature"]
+        self.llms = {}
+        self.llm = self.get_provider(self.provider)
         self.rate_limit = config.get("rate_limit", RATE_LIMIT)
+        self.rate_limiter = RateLimiter(self.rate_limit)
+        self.continuations = config.get("continuations", CONTINUATIONS)
+        self.retries = config.get("retries", RETRIES)
+        self.retry_backoff = config.get("retry_backoff", RETRY_BACKOFF)
+        self.deadline = config.get("deadline", None)
+        self.hedge = config.get("hedge", False)
+        self.latency = LatencyTracker()
+        self.stats = Counter()
+        self.stats_lock = threading.Lock()
+        self.sampled = {}
+        self.progress = None
         cache_dir = config.get("cache", None)
         self.cache = None
         if cache_dir:
-            self.cache = Cache(cache_dir)
+            self.cache = Cache(cache_dir, compress=config.get("cache_compress", False))
 
     def log(self, msg: str):
         """Print some progress info unless set to quiet mode"""
         if not self.quiet:
             print(msg)
 
+    def count(self, stat: str, n: int = 1):
+        """Add to one of the run statistics, like retries"""
+        with self.stats_lock:
+            self.stats[stat] += n
+
+    def record(self, outcome: str):
+        """Count a finished prompt if there's a Progress tracker"""
+        if self.progress is not None:
+            self.progress.record(outcome)
+
     @property
     def judgment(self) -> str:
         return self._judgment
@@ -62,7 +127,61 @@ class Classifier:
     @judgment.setter
     def judgment(self, v: str):
         self._judgment = v
-        self._prompt_judgment = self.judgment_template.format(judgment=json.dumps(v))
+        self._index = None
+        self._judgment_message = None
+        self._prompt_judgment = self.judgment_template.format(
+            judgment=self.encode_judgment(v)
+        )
+
+    def encode_judgment(self, judgment: dict, numbered: bool = False) -> str:
+        """The judgment as it goes into the prompts: JSON, or compact
+        paragraph-numbered text if preprocess is set in the config. Set
+        numbered if the judgment text has already been numbered."""
+        if self.preprocess:
+            return compact_text(judgment, self.judgment_field, numbered=numbered)
+        return json.dumps(judgment)
+
+    @property
+    def index(self) -> JudgmentIndex:
+        """The paragraph index of the current judgment, built the first time
+        an excerpted prompt needs it"""
+        if self._index is None:
+            text = self._judgment.get(self.judgment_field, "")
+            if self.preprocess:
+                # keep the paragraph numbers when the text is cut down
+                text = "\n".join(number_paragraphs(text))
+            self._index = JudgmentIndex(text)
+        return self._index
+
+    def prompt_judgment(self, prompt: CasePrompt) -> str:
+        """The JSON-encoded judgment for a prompt: if the prompt has an
+        excerpt size, the judgment text is cut down to that many of its most
+        relevant paragraphs"""
+        if not prompt.excerpt or not self._judgment.get(self.judgment_field):
+            return self._prompt_judgment
+        judgment = dict(self._judgment)
+        judgment[self.judgment_field] = self.index.excerpt(prompt.query, prompt.excerpt)
+        # with preprocess, the index's paragraphs are numbered already
+        encoded = self.encode_judgment(judgment, numbered=True)
+        return self.judgment_template.format(judgment=encoded)
+
+    def get_provider(self, name: str) -> Provider:
+        """Returns the Provider for a named entry in the providers config,
+        creating it the first time it's asked for"""
+        if name not in self.llms:
+            if name not in self.providers_cf:
+                raise PromptException(f"Unknown provider: {name}")
+            self.llms[name] = make_provider(
+                name, self.providers_cf[name], self.temperature
+            )
+        return self.llms[name]
+
+    def provider_for(self, prompt: CasePrompt) -> Provider:
+        """Returns the Provider which a prompt is routed to - the default
+        unless the prompts sheet gives it a provider of its own"""
+        if prompt.provider:
+            return self.get_provider(prompt.provider)
+        return self.llm
 
     def prompt(self, name: str) -> CasePrompt:
         """Returns a named prompt object"""
@@ -80,7 +199,7 @@ class Classifier:
         the prompt questions (which also will include examples for the LLM to
         return)"""
         if self._prompt_judgment is not None:
-            content = self._prompt_judgment + prompt.prompt
+            content = self.prompt_judgment(prompt) + prompt.prompt
             return HumanMessage(content=content)
         else:
             raise PromptException(
@@ -88,8 +207,243 @@ class Classifier:
                 " calling make_message()"
             )
 
+    def make_messages(self, prompt: CasePrompt) -> list[HumanMessage]:
+        """The messages to send for a prompt. Normally this is the single
+        message from make_message, but with split_judgment set in the config
+        the judgment is sent in its own message, followed by the prompt
+        questions. The judgment message is only built once per case and is
+        shared by every prompt which isn't excerpted, so the judgment isn't
+        copied for each prompt."""
+        if not self.split_judgment:
+            return [self.make_message(prompt)]
+        if self._prompt_judgment is None:
+            raise PromptException(
+                "Need to set the judgment with judgment() before"
+                " calling make_messages()"
+            )
+        if prompt.excerpt:
+            judgment = HumanMessage(content=self.prompt_judgment(prompt))
+        else:
+            if self._judgment_message is None:
+                self._judgment_message = HumanMessage(content=self._prompt_judgment)
+            judgment = self._judgment_message
+        return [judgment, HumanMessage(content=prompt.prompt)]
+
+    def get_response(
+        self,
+        case_id: str,
+        prompt: CasePrompt,
+        no_cache: bool = False,
+        cache_only: bool = False,
+    ) -> str:
+        """Returns the raw response to a prompt from the cache if there is one
+        and no_cache isn't set, or else from the LLM, in which case it is
+        written to the cache. Errors from the LLM are raised. A response which
+        can't be parsed is counted as failed in the progress.
+
+        In test mode the mock response stands in for the LLM and nothing is
+        cached. With cache_only, a missing cache entry raises PromptException
+        instead of calling the LLM."""
+        messages = self.make_messages(prompt)
+        response = None
+        if self.cache and not no_cache:
+            response = self.cache.read(case_id, prompt.name)
+        if response is not None:
+            self.log(f"[{case_id}] {prompt.name} - cached result")
+            self.record("cached" if prompt.is_valid(response) else "failed")
+            return response
+        if self.test:
+            self.log(f"[{case_id}] {prompt.name} - mock result")
+            self.record("cached")
+            return prompt.mock_response()
+        if cache_only:
+            raise PromptException(f"No cached result for {prompt.name}")
+        llm = self.provider_for(prompt)
+        if prompt.samples > 1:
+            samples = self.sample(case_id, llm, messages, prompt)
+            response, _ = prompt.vote(samples)
+        else:
+            response = self.ask(case_id, llm, messages, prompt)
+        if self.cache:
+            self.cache.write(
+                case_id,
+                prompt.name,
+                response,
+                model=llm.model,
+                prompt_hash=prompt.fingerprint,
+            )
+            if prompt.samples > 1:
+                self.cache.write(
+                    case_id,
+                    prompt.name + SAMPLES,
+                    json.dumps(samples),
+                    model=llm.model,
+                    prompt_hash=prompt.fingerprint,
+                )
+        self.record("completed" if prompt.is_valid(response) else "failed")
+        return response
+
+    def ask(
+        self,
+        case_id: str,
+        llm: Provider,
+        messages: list[HumanMessage],
+        prompt: CasePrompt,
+    ) -> str:
+        """Send the messages for one prompt to the LLM when the rate limit
+        allows, with the prompt's output token limit. If the answer is cut off
+        by the limit, ask the LLM to continue it, up to continuations times."""
+        request = messages
+        content = ""
+        for attempt in range(self.continuations + 1):
+            response = self.chat(case_id, llm, request, prompt)
+            content += response.content
+            if not response.truncated:
+                break
+            self.log(f"[{case_id}] {prompt.name} - truncated, continuing")
+            request = messages + [
+                AIMessage(content=content),
+                HumanMessage(content=CONTINUE),
+            ]
+        return content
+
+    def chat(
+        self,
+        case_id: str,
+        llm: Provider,
+        messages: list[HumanMessage],
+        prompt: CasePrompt,
+    ) -> ChatResponse:
+        """Make one request to the LLM when the rate limit allows. Transient
+        errors like rate limits and timeouts are retried up to retries times,
+        backing off exponentially with some jitter."""
+        for attempt in range(self.retries + 1):
+            waited = self.rate_limiter.wait()
+            if waited > 0:
+                self.log(f"[{case_id}] paused for {waited:.1f}")
+            self.log(f"[{case_id}] {prompt.name} - asking {llm.name}")
+            try:
+                response = self.call(case_id, llm, messages, prompt)
+            except Exception as e:
+                if attempt == self.retries or not is_transient(e):
+                    raise
+                backoff = self.retry_backoff * 2**attempt * random.uniform(0.5, 1.5)
+                self.log(f"[{case_id}] {prompt.name} - {e}, retrying in {backoff:.1f}")
+                self.count("retries")
+                time.sleep(backoff)
+                continue
+            if self.progress is not None:
+                self.progress.request(response.usage)
+            return response
+
+    def call(
+        self,
+        case_id: str,
+        llm: Provider,
+        messages: list[HumanMessage],
+        prompt: CasePrompt,
+    ) -> ChatResponse:
+        """Send one request to the LLM, with the deadline and hedging from
+        the config if they're set.
+
+        With a deadline, DeadlineExceeded is raised if there's no answer in
+        time, and the request is retried like other transient errors. With
+        hedging, once the prompt has enough history, a request which takes
+        longer than the prompt's 95th percentile latency gets a duplicate
+        request, if there's a free slot in the rate limit, and the first
+        response which parses is used. Requests which lose or are abandoned
+        can't be interrupted: they finish in the background and their
+        responses are thrown away."""
+
+        def send() -> ChatResponse:
+            started = time.monotonic()
+            response = llm.chat(messages, prompt, max_tokens=prompt.token_limit)
+            self.latency.add(prompt.name, time.monotonic() - started)
+            return response
+
+        if not (self.hedge or self.deadline):
+            return send()
+        started = time.monotonic()
+        primary = run_in_thread(send)
+        futures = [primary]
+        threshold = self.latency.threshold(prompt.name) if self.hedge else None
+        if threshold is not None and (not self.deadline or threshold < self.deadline):
+            done, _ = wait([primary], timeout=threshold)
+            if not done:
+                if self.rate_limiter.try_reserve():
+                    self.log(f"[{case_id}] {prompt.name} - slow, hedging")
+                    self.count("hedged")
+                    futures.append(run_in_thread(send))
+                else:
+                    self.count("hedge_skipped")
+        timeout = None
+        if self.deadline:
+            timeout = max(0, self.deadline - (time.monotonic() - started))
+        try:
+            winner, response = first_valid(
+                futures, lambda r: prompt.is_valid(r.content), timeout
+            )
+        except DeadlineExceeded:
+            self.count("deadline_exceeded")
+            raise
+        if winner is not primary:
+            self.count("hedge_won")
+        return response
+
+    def sample(
+        self,
+        case_id: str,
+        llm: Provider,
+        messages: list[HumanMessage],
+        prompt: CasePrompt,
+    ) -> list[str]:
+        """Ask the LLM the same prompt up to prompt.samples times for a
+        majority vote. The first round sends just enough requests concurrently
+        to make a majority; if they don't agree, each further round sends the
+        fewest which could still decide it. Sampling stops as soon as every
+        answer has a majority, or when a majority is no longer possible."""
+        samples = []
+        needed = prompt.samples // 2 + 1
+        with ThreadPoolExecutor(max_workers=needed) as pool:
+            while needed <= prompt.samples - len(samples):
+                futures = [
+                    pool.submit(self.ask, case_id, llm, messages, prompt)
+                    for _ in range(needed)
+                ]
+                samples.extend(f.result() for f in futures)
+                needed = prompt.votes_needed(samples)
+                if needed == 0:
+                    break
+        self.log(f"[{case_id}] {prompt.name} - {len(samples)} samples")
+        self.sampled[(case_id, prompt.name)] = samples
+        return samples
+
+    def agreement(self, case_id: str, prompt: CasePrompt) -> dict[str, float]:
+        """Returns the fraction of samples which agreed with the majority
+        answer to each field of a sampled prompt, from the last run or else
+        from the samples in the cache"""
+        samples = self.sampled.pop((case_id, prompt.name), None)
+        if samples is None and self.cache:
+            cached = self.cache.read(case_id, prompt.name + SAMPLES)
+            if cached is not None:
+                samples = json.loads(cached)
+        if not samples:
+            return None
+        _, agreement = prompt.vote(samples)
+        return agreement
+
+    def add_agreement(self, results: ResultsDict, case_id: str, prompt: CasePrompt):
+        """Adds the agreement for a sampled prompt to a case's results"""
+        if prompt.samples > 1:
+            agreement = self.agreement(case_id, prompt)
+            results.setdefault(AGREEMENT, {})[prompt.name] = agreement
+
     def run_prompt(
-        self, case_id: str, prompt: CasePrompt, no_cache: bool = False
+        self,
+        case_id: str,
+        prompt: CasePrompt,
+        no_cache: bool = False,
+        cache_only: bool = False,
     ) -> ResultsDict:
         """Actually send prompt to LLM, unless there's already a response in the
         cache or no_cache is True
@@ -101,31 +455,11 @@ class Classifier:
         the response if required (for json prompts)
 
         """
-        message = self.make_message(prompt)
-        response = None
         try:
-            if self.test:
-                if self.cache and not no_cache:
-                    response = self.cache.read(case_id, prompt.name)
-                if response is not None:
-                    self.log(f"[{case_id}] {prompt.name} - cached result")
-                else:
-                    self.log(f"[{case_id}] {prompt.name} - mock result")
-                    response = prompt.mock_response()
-            else:
-                if self.cache and not no_cache:
-                    response = self.cache.read(case_id, prompt.name)
-                if response is not None:
-                    self.log(f"[{case_id}] {prompt.name} - cached result")
-                else:
-                    self.log(f"[{case_id}] {prompt.name} - asking LLM")
-                    response = self.chat([message]).content
-                    self.log(f"[{case_id}] pausing for {self.rate_limit}")
-                    time.sleep(self.rate_limit)
+            response = self.get_response(case_id, prompt, no_cache, cache_only)
         except Exception as e:
+            self.record("failed")
             return prompt.wrap_error(str(e))
-        if self.cache and not self.test:
-            self.cache.write(case_id, prompt.name, response)
         return prompt.parse_response(response)
 
     def classify(
@@ -134,29 +468,172 @@ class Classifier:
         test: bool = False,
         prompts: list[str] = None,
         no_cache: bool = False,
+        cache_only: bool = False,
     ) -> ResultsDict:
         """Run the classifier for a single case and returns the results as a
-        dict by prompt label."""
-        self.test = test
-        case_id = casefile.stem
+        dict by prompt label. With cache_only, results are only read from the
+        cache and the LLM is never called."""
         self.load_judgment(casefile)
-        results = {"file": str(casefile), "mnc": self.judgment["mnc"]}
+        return self.classify_judgment(
+            casefile.stem,
+            self.judgment,
+            test=test,
+            prompts=prompts,
+            no_cache=no_cache,
+            cache_only=cache_only,
+            file=str(casefile),
+        )
+
+    def classify_judgment(
+        self,
+        case_id: str,
+        judgment: dict,
+        test: bool = False,
+        prompts: list[str] = None,
+        no_cache: bool = False,
+        cache_only: bool = False,
+        file: str = None,
+    ) -> ResultsDict:
+        """Run the classifier for a judgment which has already been loaded,
+        with case_id as its key in the cache. The results' "file" is the case
+        ID unless a filename is given."""
+        self.test = test
+        if judgment is not self._judgment:
+            self.judgment = judgment
+        results = {"file": file or case_id, "mnc": judgment["mnc"]}
         system_prompt = self.start_chat()
 
-        if not self.test:
-            self.chat([system_prompt])
+        if not (self.test or cache_only):
+            try:
+                self.llm.chat([system_prompt])
+            except Exception as e:
+                # nothing depends on the reply, so don't fail the case
+                self.log(f"[{case_id}] system prompt failed: {e}")
 
         for prompt in self.next_prompt():
             if not prompts or prompt.name in prompts:
                 results[prompt.name] = self.run_prompt(
-                    case_id, prompt, no_cache=no_cache
+                    case_id, prompt, no_cache=no_cache, cache_only=cache_only
                 )
+                self.add_agreement(results, case_id, prompt)
+        return results
+
+    def classify_many(
+        self,
+        judgments: Iterable[dict | tuple[str, dict] | Path],
+        concurrency: int = 4,
+        test: bool = False,
+        prompts: list[str] = None,
+        no_cache: bool = False,
+        cache_only: bool = False,
+    ) -> Generator[tuple[str, ResultsDict], None, None]:
+        """Classify a stream of judgments on concurrency threads, yielding
+        (case_id, results) as each case finishes, which won't be in the order
+        they went in. Each judgment can be a dict (identified by case_id_for),
+        a (case_id, dict) tuple or a path to a JSON casefile. A case which
+        raises an error is yielded with the error in place of every prompt's
+        results, and a judgment which can't be loaded is logged and skipped.
+
+        Judgments are only taken from the iterable when a thread is free, so
+        at most concurrency of them are in memory at once however long the
+        iterable is. The threads share this classifier's providers, cache and
+        rate limit."""
+        judgments = iter(judgments)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            running = {}
+            while True:
+                for item in judgments:
+                    worker = copy.copy(self)
+                    worker._index = None
+                    try:
+                        case_id, judgment, file = worker.unpack_judgment(item)
+                    except Exception as e:
+                        self.log(f"Couldn't load judgment {item}: {e}")
+                        continue
+                    future = pool.submit(
+                        worker.classify_judgment,
+                        case_id,
+                        judgment,
+                        test=test,
+                        prompts=prompts,
+                        no_cache=no_cache,
+                        cache_only=cache_only,
+                        file=file,
+                    )
+                    running[future] = (case_id, judgment, file)
+                    if len(running) >= concurrency:
+                        break
+                if not running:
+                    return
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    case_id, judgment, file = running.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        self.log(f"[{case_id}] failed: {e}")
+                        results = self.error_results(
+                            case_id, judgment, str(e), prompts=prompts, file=file
+                        )
+                    yield case_id, results
+
+    def error_results(
+        self,
+        case_id: str,
+        judgment: dict,
+        error: str,
+        prompts: list[str] = None,
+        file: str = None,
+    ) -> ResultsDict:
+        """Results for a case which couldn't be classified, with the error in
+        place of each prompt's results"""
+        results = {"file": file or case_id, "mnc": judgment.get("mnc", "")}
+        for name in self.prompt_names:
+            if not prompts or name in prompts:
+                results[name] = self.prompts[name].wrap_error(error)
         return results
 
+    def unpack_judgment(self, item) -> tuple[str, dict, str]:
+        """Returns the case ID, judgment and filename (if any) for one of
+        the items passed to classify_many. Casefiles are loaded with
+        load_judgment, so they come from the judgment cache if they can."""
+        if isinstance(item, Path):
+            self.load_judgment(item)
+            return item.stem, self._judgment, str(item)
+        if type(item) is tuple:
+            case_id, judgment = item
+            return case_id, judgment, None
+        return case_id_for(item), item, None
+
     def load_judgment(self, casefile: Path):
-        """Loads a Path as a JSON casefile"""
-        with open(casefile, "r") as fh:
-            self.judgment = json.load(fh)
+        """Loads a Path as a JSON casefile. Judgments which have been loaded
+        before are taken from the judgment cache if they haven't changed.
+
+        With preprocess set, the compact text of the judgment is kept next to
+        its cache entries with the hash of the casefile, so that it's only
+        built once for each version of the case."""
+        key, raw = read_casefile(casefile)
+        cached = self.judgments.get(key)
+        if cached is None:
+            judgment = json.loads(raw)
+            encoded = None
+            if self.preprocess and self.cache:
+                encoded = load_artifact(
+                    self.cache, casefile.stem, key, self.judgment_field
+                )
+            if encoded is None:
+                encoded = self.encode_judgment(judgment)
+                if self.preprocess and self.cache:
+                    save_artifact(
+                        self.cache, casefile.stem, key, encoded, self.judgment_field
+                    )
+            cached = (judgment, self.judgment_template.format(judgment=encoded))
+            # the encoded judgment is about the size of the file, and the
+            # parsed judgment takes at least as much again
+            self.judgments.put(key, *cached, 2 * len(raw) + len(cached[1]))
+        self._judgment, self._prompt_judgment = cached
+        self._index = None
+        self._judgment_message = None
 
     def show_prompt(self, prompt_name: str):
         """This returns the named prompt without the judgement"""
@@ -174,11 +651,13 @@ class Classifier:
 
         intro = pd.read_excel(spreadsheet, sheet_name="intro")
         self.judgment_template = intro["Intro"][0]
+        self.judgments.clear()
         self.load_prompt_sheet(spreadsheet)
 
         self.headers = ["file", "mnc"]
         for name in self.prompt_names:
             self.headers.extend(self.prompts[name].headers)
+            self.headers.extend(self.prompts[name].agreement_headers)
 
     def load_prompt_sheet(self, spreadsheet: str):
         """Loads the worksheet with prompt definitions from the spreadsheet"""
@@ -206,6 +685,24 @@ class Classifier:
     def add_prompt(self, row, fields: list[CasePromptField]):
         """Converts a spreadsheet row into a CasePrompt and add it to the
         prompts dict"""
+        samples = 1
+        if row.get("samples", ""):
+            try:
+                samples = int(row["samples"])
+            except ValueError:
+                raise PromptException("'samples' must be an integer")
+        max_tokens = None
+        if row.get("max_tokens", ""):
+            try:
+                max_tokens = int(row["max_tokens"])
+            except ValueError:
+                raise PromptException("'max_tokens' must be an integer")
+        excerpt = None
+        if row.get("excerpt", ""):
+            try:
+                excerpt = int(row["excerpt"])
+            except ValueError:
+                raise PromptException("'excerpt' must be an integer")
         repeats = 1
         if row["return_type"] == "json_multiple":
             if row["repeats"]:
@@ -216,6 +713,9 @@ class Classifier:
         name = row["Prompt_name"]
         if name in self.prompt_names:
             raise ValueError(f"Prompt with name {name} defined twice")
+        provider = row.get("provider", "")
+        if provider and provider not in self.providers_cf:
+            raise PromptException(f"Prompt {name} has unknown provider {provider}")
         self.prompt_names.append(name)
         self.prompts[name] = CasePrompt(
             name=row["Prompt_name"],
@@ -225,6 +725,10 @@ class Classifier:
             additional_instruction=row["additional_instruction"],
             fields=fields,
             repeats=repeats,
+            provider=provider or None,
+            samples=samples,
+            excerpt=excerpt,
+            max_tokens=max_tokens,
         )
 
     def collimate_one(self, name: str, results: ResultsDict):
@@ -235,16 +739,23 @@ class Classifier:
         """Take the dict of results returned by classify and aligns it
         with the column headers from the prompts"""
         cols = [results["file"], results["mnc"]]
+        agreement = results.get(AGREEMENT, {})
         for name in self.prompt_names:
             cols.extend(self.collimate_one(name, results.get(name, None)))
+            cols.extend(self.prompts[name].agreement_columns(agreement.get(name)))
         return cols
 
     def as_dict(self, results: ResultsDict) -> FlatResultsDict:
         """Takes the dict of results returned by classify and returns a
         flattened dict (no nesting, keys are the same as prompts.headers)"""
         d = {"file": results["file"], "mnc": results["mnc"]}
+        agreement = results.get(AGREEMENT, {})
         for name in self.prompt_names:
-            r = self.prompts[name].flatten(results[name])
+            prompt = self.prompts[name]
+            r = prompt.flatten(results[name])
             for k, v in r.items():
                 d[k] = v
+            columns = prompt.agreement_columns(agreement.get(name))
+            for k, v in zip(prompt.agreement_headers, columns):
+                d[k] = v
         return d
@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import logging
 from itertools import chain
 import json
@@ -7,6 +8,7 @@ from openpyxl import load_workbook, Workbook
 import re
 
 from langchainlaw.cache import Cache
+from langchainlaw.progress import make_progress
 from langchainlaw.prompts import parse_llm_json
 
 logger = logging.getLogger(__name__)
@@ -18,6 +20,9 @@ MAX_RE = re.compile("context length")
 
 DEFENDANT_RE = re.compile("defendant", flags=re.I)
 
+INDEX = ".index.json"
+STATE = ".state.json"
+
 
 def load_config(cf_file):
     """Load the config JSON"""
@@ -51,33 +56,97 @@ def expand_ra_cols(cf):
     return list(chain.from_iterable(base))  # flattens list of lists
 
 
-def load_ra_spreadsheet(config):
+def iter_ra_rows(config, cols=None, min_row=2, max_row=None):
+    """Yields (row number, dict of values) for each row of the RA spreadsheet,
+    skipping the header. The workbook is opened read-only so rows are
+    streamed from the file rather than all loaded into memory."""
+    if cols is None:
+        cols = expand_ra_cols(config)
+    wb = load_workbook(config["SPREADSHEET_IN"], read_only=True)
+    try:
+        rows = wb.active.iter_rows(min_row=min_row, max_row=max_row, values_only=True)
+        for row_i, values in enumerate(rows, start=min_row):
+            # read-only rows can be shorter than the header
+            case = dict.fromkeys(cols)
+            case.update(zip(cols, values))
+            yield row_i, case
+    finally:
+        wb.close()
+
+
+def ra_index_file(config):
+    return Path(config.get("SPREADSHEET_INDEX", config["SPREADSHEET_IN"] + INDEX))
+
+
+def load_ra_index(config, cols=None):
+    """Returns a dict of case ID -> list of row numbers in the RA spreadsheet.
+
+    The index is saved next to the spreadsheet and rebuilt when the
+    spreadsheet's size or modification time changes. Building it only reads
+    the uri column."""
+    if cols is None:
+        cols = expand_ra_cols(config)
+    stat = Path(config["SPREADSHEET_IN"]).stat()
+    signature = [stat.st_mtime_ns, stat.st_size]
+    index_file = ra_index_file(config)
+    if index_file.is_file():
+        with open(index_file, "r") as fh:
+            saved = json.load(fh)
+        if saved["signature"] == signature:
+            return saved["rows"]
+    uri_col = cols.index("uri") + 1
+    index = {}
+    wb = load_workbook(config["SPREADSHEET_IN"], read_only=True)
+    try:
+        uris = wb.active.iter_rows(
+            min_row=2, min_col=uri_col, max_col=uri_col, values_only=True
+        )
+        for row_i, (uri,) in enumerate(uris, start=2):
+            case_id = parse_case_uri(uri)
+            if case_id:
+                index.setdefault(case_id, []).append(row_i)
+    finally:
+        wb.close()
+    with open(index_file, "w") as fh:
+        json.dump({"signature": signature, "rows": index}, fh)
+    return index
+
+
+def load_ra_spreadsheet(config, case_ids=None):
     """Load the spreadsheet with the RA's summary of the cases
 
+    If case_ids is given, the index is used to read only the rows between the
+    first and last of those cases.
+
     Returns a dict of ID -> list of spreadsheet rows
     """
     cases = {}
-    header = True
     cols = expand_ra_cols(config)
-    wb = load_workbook(config["SPREADSHEET_IN"])
-    for row in wb.active:
-        if header:
-            header = False
-        else:
-            case = dict(zip(cols, [cell.value for cell in row]))
-            case["id"] = parse_case_uri(case["uri"])
-            if case["id"]:
-                if case["id"] not in cases:
-                    cases[case["id"]] = [case]
-                else:
-                    if not case["mnc"]:
-                        # mnc cells are merged so get it from the first row
-                        case["mnc"] = cases[case["id"]][0]["mnc"]
-                    cases[case["id"]].append(case)
+    min_row = 2
+    max_row = None
+    wanted = None
+    if case_ids is not None:
+        index = load_ra_index(config, cols)
+        wanted = {r for case_id in case_ids for r in index.get(case_id, [])}
+        if not wanted:
+            return cols, cases
+        min_row = min(wanted)
+        max_row = max(wanted)
+    for row_i, case in iter_ra_rows(config, cols, min_row, max_row):
+        if wanted is not None and row_i not in wanted:
+            continue
+        case["id"] = parse_case_uri(case["uri"])
+        if case["id"]:
+            if case["id"] not in cases:
+                cases[case["id"]] = [case]
             else:
-                uri = case["uri"]
-                row_i = row[0].row
-                logger.warning(f"Row [{row_i}]: Couldn't parse case ID from {uri}")
+                if not case["mnc"]:
+                    # mnc cells are merged so get it from the first row
+                    case["mnc"] = cases[case["id"]][0]["mnc"]
+                cases[case["id"]].append(case)
+        else:
+            uri = case["uri"]
+            logger.warning(f"Row [{row_i}]: Couldn't parse case ID from {uri}")
     return cols, cases
 
 
@@ -100,7 +169,7 @@ def find_cached_results(cache, caseid, mapping):
         return None
     for field, spreadsheet in mapping.items():
         try:
-            mapped[field] = cache.read(caseid, field)
+            mapped[field] = cache.load(caseid, field)
             if MAX_RE.search(mapped[field]):
                 logger.warning(f"Case {caseid} exceeded token length")
                 return None
@@ -206,18 +275,85 @@ def dump_cases(ra_cases):
 
 def test_flatten(cf):
     """test flattening on cases which aren't in the RA spreadsheet"""
-    cache_dir = Path(cf["CACHE"])
     cache = Cache(cf["CACHE"])
     mapping = cf["SPREADSHEET_OUT_COLS"]
     full_cols = expand_ra_cols(cf)
-    for item in cache_dir.glob("*"):
-        if item.is_dir():
-            case_id = item.name
-            print(case_id)
-            llm_results = find_cached_results(cache, case_id, mapping)
-            if llm_results is not None:
-                llm_cols = flatten_llm_result(full_cols, mapping, llm_results)
-                print(llm_cols)
+    for case_id in cache.case_ids():
+        print(case_id)
+        llm_results = find_cached_results(cache, case_id, mapping)
+        if llm_results is not None:
+            llm_cols = flatten_llm_result(full_cols, mapping, llm_results)
+            print(llm_cols)
+
+
+def collate_state_file(cf):
+    return Path(cf.get("COLLATE_STATE", cf["SPREADSHEET_OUT"] + STATE))
+
+
+def collate_layout(cols, mappings):
+    """A hash of the RA columns and the mappings, which determine how the LLM
+    columns are built"""
+    layout = json.dumps([cols, mappings], sort_keys=True)
+    return hashlib.sha1(layout.encode("utf-8")).hexdigest()
+
+
+def load_collate_state(state_file, layout):
+    """The collate state has the flattened LLM columns for each case from the
+    last run, with the fingerprint of the cache entries they came from. It's
+    thrown away if it was saved with a different layout."""
+    if state_file.is_file():
+        with open(state_file, "r") as fh:
+            saved = json.load(fh)
+        if saved.get("layout") == layout:
+            return saved["cases"]
+        logger.warning("Columns or mappings have changed, re-reading every case")
+    return {}
+
+
+def save_collate_state(state_file, state, layout):
+    with open(state_file, "w") as fh:
+        json.dump({"layout": layout, "cases": state}, fh)
+
+
+def collate_llm(cols, mappings, cache, case_id, state, incremental=False):
+    """Returns the flattened LLM columns for a case, or None if there are no
+    results. In incremental mode, if the case's cache entries haven't changed
+    since the last run the saved columns are returned without reading the
+    cache. Either way the state is updated."""
+    fingerprint = cache.fingerprint(case_id, list(mappings))
+    saved = state.get(case_id)
+    if incremental and saved is not None and saved["fingerprint"] == fingerprint:
+        return saved["llm_cols"]
+    llm_cols = None
+    llm_results = find_cached_results(cache, case_id, mappings)
+    if llm_results is not None:
+        llm_cols = flatten_llm_result(cols, mappings, llm_results)
+    state[case_id] = {"fingerprint": fingerprint, "llm_cols": llm_cols}
+    return llm_cols
+
+
+def collate_rows(
+    cols, mappings, cache, ra_cases, state, incremental=False, progress=None
+):
+    """Yields the rows of the collated spreadsheet: the header, then for each
+    case the RA's rows followed by the LLM's"""
+    yield cols
+    for case_id, ra_case in ra_cases.items():
+        if progress is None:
+            logger.warning(case_id)
+        for ra_row in ra_case:
+            yield [ra_row[c] for c in cols]
+        llm_cols = collate_llm(cols, mappings, cache, case_id, state, incremental)
+        if llm_cols is not None:
+            llm_cols = list(llm_cols)
+            for i in range(11):
+                llm_cols[i] = ra_case[0][cols[i]]
+            llm_cols[1] = "GPT-4o"
+            yield llm_cols
+        else:
+            yield [ra_case[0][cols[0]], "GPT-4o", "No results"]
+        if progress is not None:
+            progress.record("failed" if llm_cols is None else "completed")
 
 
 def collate():
@@ -234,28 +370,54 @@ def collate():
         default=False,
         help="Flatten multiple results into a single row",
     )
+    ap.add_argument(
+        "--cases",
+        default="",
+        type=str,
+        help="Comma-separated case IDs to collate (default is all of them)",
+    )
+    ap.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only re-read the cache for cases whose entries have changed",
+    )
+    ap.add_argument(
+        "--progress",
+        action="store_true",
+        default=False,
+        help="Show a progress line with throughput and ETA instead of logging",
+    )
+    ap.add_argument(
+        "--metrics-port",
+        default=None,
+        type=int,
+        help="Serve Prometheus metrics on this local port at /metrics",
+    )
     args = ap.parse_args()
     cf = load_config(args.config)
-    cols, ra_cases = load_ra_spreadsheet(cf)
+    case_ids = [c for c in args.cases.split(",") if c] or None
+    cols, ra_cases = load_ra_spreadsheet(cf, case_ids)
     mappings = cf["SPREADSHEET_OUT_COLS"]
     cache = Cache(cf["CACHE"])
+    state_file = collate_state_file(cf)
+    layout = collate_layout(cols, mappings)
+    state = load_collate_state(state_file, layout)
     results = Workbook()
     ws = results.active
-    ws.append(cols)
-    for case_id, ra_case in ra_cases.items():
-        logger.warning(case_id)
-        for ra_row in ra_case:
-            ws.append([ra_row[c] for c in cols])
-        llm_results = find_cached_results(cache, case_id, mappings)
-        if llm_results is not None:
-            llm_cols = flatten_llm_result(cols, mappings, llm_results)
-            for i in range(11):
-                llm_cols[i] = ra_case[0][cols[i]]
-            llm_cols[1] = "GPT-4o"
-            ws.append(llm_cols)
-        else:
-            ws.append([ra_case[0][1], "GPT-4o", "No results"])
+    progress = None
+    if args.progress or args.metrics_port:
+        progress = make_progress(
+            len(ra_cases), show=args.progress, port=args.metrics_port
+        )
+    for row in collate_rows(
+        cols, mappings, cache, ra_cases, state, args.incremental, progress
+    ):
+        ws.append(row)
+    if progress is not None:
+        progress.finish()
     results.save(cf["SPREADSHEET_OUT"])
+    save_collate_state(state_file, state, layout)
     logger.warning("Wrote collated results to " + cf["SPREADSHEET_OUT"])
 
 
@@ -0,0 +1,114 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from langchainlaw.classifier import Classifier
+from langchainlaw.scheduler import Scheduler, WorkItem, WINDOW, estimate_item
+
+REPORT_COLS = [
+    "case",
+    "prompt",
+    "chars",
+    "input_tokens",
+    "output_tokens",
+    "cost",
+    "cached",
+]
+
+# each worker process builds its own Classifier once, in init_worker
+_classifier = None
+_prompts = None
+
+
+def init_worker(config: dict, prompts: list[str]):
+    global _classifier, _prompts
+    _classifier = Classifier(config, quiet=True)
+    _classifier.load_prompts(config["prompts"])
+    _prompts = prompts
+
+
+def render_case(casefile: Path, outdir: Path) -> list[tuple[WorkItem, int]]:
+    """Renders every message for a case to a text file in outdir and returns
+    a WorkItem and the length in characters for each prompt"""
+    classifier = _classifier
+    classifier.load_judgment(casefile)
+    system = classifier.start_chat().content
+    rendered = []
+    with open(outdir / f"{casefile.stem}.txt", "w") as fh:
+        for prompt in classifier.next_prompt():
+            if _prompts and prompt.name not in _prompts:
+                continue
+            messages = classifier.make_messages(prompt)
+            fh.write(f"Prompt: {prompt.name}\n\n")
+            for message in messages:
+                fh.write(message.content)
+                fh.write("\n\n")
+            item = estimate_item(classifier, casefile.stem, casefile, prompt)
+            chars = len(system) + sum(len(m.content) for m in messages)
+            rendered.append((item, chars))
+    return rendered
+
+
+def dry_run(
+    config: dict,
+    cases: list[Path],
+    prompts: list[str] = None,
+    workers: int = None,
+) -> list[WorkItem]:
+    """Render the full message for every case and prompt across a pool of
+    processes without calling the LLM. The messages are written to one text
+    file per case in the dry_run directory and their sizes are streamed to a
+    CSV report as each case finishes. Returns the WorkItems so that the run
+    can be sized with a Scheduler."""
+    outdir = Path(config.get("dry_run", "dry_run"))
+    outdir.mkdir(parents=True, exist_ok=True)
+    report = config.get("dry_run_report", str(outdir / "report.csv"))
+    workers = workers or os.cpu_count()
+    items = []
+    with open(report, "w", newline="") as rfh, ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(config, prompts)
+    ) as pool:
+        writer = csv.writer(rfh)
+        writer.writerow(REPORT_COLS)
+        rendered = pool.map(render_case, cases, [outdir] * len(cases))
+        for case_items in rendered:
+            for item, chars in case_items:
+                writer.writerow(
+                    [
+                        item.case_id,
+                        item.prompt,
+                        chars,
+                        item.input_tokens,
+                        item.output_tokens,
+                        f"{item.cost:.6f}",
+                        item.cached,
+                    ]
+                )
+                items.append(item)
+    print(f"Wrote rendered prompts to {outdir} and sizes to {report}")
+    return items
+
+
+def size_report(items: list[WorkItem], rate_limit: float, tokens_per_minute: int):
+    """Summarise the size, cost and projected wall time of a run"""
+    requests = [i for i in items if not i.cached]
+    rpm = None
+    if rate_limit:
+        rpm = max(1, int(WINDOW / rate_limit))
+    scheduler = Scheduler(
+        items, tokens_per_minute=tokens_per_minute, requests_per_minute=rpm
+    )
+    minutes = len([w for w in scheduler.windows() if any(not i.cached for i in w)])
+    input_tokens = sum(i.input_tokens for i in requests)
+    output_tokens = sum(i.output_tokens for i in requests)
+    cost = sum(i.cost for i in requests)
+    return "\n".join(
+        [
+            f"Prompts: {len(items)} ({len(items) - len(requests)} cached)",
+            f"Requests: {len(requests)}",
+            f"Estimated tokens: {input_tokens} in, {output_tokens} out",
+            f"Projected cost: ${cost:.2f}",
+            f"Projected time: {minutes} minutes",
+        ]
+    )
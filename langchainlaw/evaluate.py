@@ -0,0 +1,235 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from langchainlaw.cache import Cache
+from langchainlaw.collate import (
+    find_cached_results,
+    flatten_llm_result,
+    load_config,
+    load_ra_spreadsheet,
+    logger,
+)
+from langchainlaw.prompts import PARA_REF_RE, parse_llm_json
+
+PUNCT_RE = r"[^\w\s]"
+DATE_RE = r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4})"
+
+# answers which all mean that there's nothing to report
+MISSING = {
+    "",
+    "-",
+    "n/a",
+    "na",
+    "nan",
+    "none",
+    "null",
+    "not stated",
+    "not mentioned",
+    "not specified",
+    "answer not found",
+}
+
+PARTY_TYPES = ["claimant", "defendant"]
+
+
+def evaluation_fields(mappings: dict) -> dict[str, tuple[str, str]]:
+    """Returns a dict of RA column -> (prompt, field in the LLM's JSON) for
+    every RA column which the LLM results map to. The field is None where the
+    LLM's value goes straight into the column."""
+    fields = {}
+    for prompt, mapping in mappings.items():
+        if prompt == "parties":
+            continue
+        if type(mapping) is str:
+            fields[mapping] = (prompt, None)
+        else:
+            for llm_field, ra_col in mapping.items():
+                if ra_col is not None:
+                    fields[ra_col] = (prompt, llm_field)
+    return fields
+
+
+def party_fields(cols: list[str], mappings: dict) -> dict[str, tuple[str, str]]:
+    """The expanded claimant_n_* and defendant_n_* RA columns which have a
+    value from the LLM's parties prompt"""
+    party_cols = [c for c in mappings.get("parties", {}).values() if c is not None]
+    fields = {}
+    for col in cols:
+        for party_type in PARTY_TYPES:
+            if col.startswith(party_type + "_"):
+                if col.split("_", 2)[2] in party_cols:
+                    fields[col] = ("parties", None)
+    return fields
+
+
+def extract_field(value, llm_field: str):
+    """Gets a field from a JSON-encoded LLM value, joining the values if it's
+    a list of objects"""
+    try:
+        parsed = parse_llm_json(value)
+    except Exception:
+        return value
+    if type(parsed) is dict:
+        return parsed.get(llm_field, "")
+    if type(parsed) is list:
+        return "; ".join(str(p.get(llm_field, "")) for p in parsed if type(p) is dict)
+    return value
+
+
+def llm_values(cols, mappings, fields, llm_results) -> dict:
+    """Flattens one case's LLM results into a dict by RA column"""
+    values = dict(zip(cols, flatten_llm_result(cols, mappings, llm_results)))
+    for ra_col, (prompt, llm_field) in fields.items():
+        if llm_field is not None:
+            values[ra_col] = extract_field(llm_results.get(prompt, ""), llm_field)
+    return values
+
+
+def align(config, case_ids=None) -> tuple[pd.DataFrame, pd.DataFrame, dict]:
+    """Load the RA spreadsheet and the cached LLM results for the same cases.
+    Returns an RA dataframe with one row per RA annotation, an LLM dataframe
+    with the same index (so each RA row is lined up with the LLM's results for
+    its case) and a dict of RA column -> (prompt, LLM field) for the columns
+    to be scored. Cases with no LLM results, or results which can't be
+    parsed, are left out."""
+    cols, ra_cases = load_ra_spreadsheet(config, case_ids)
+    mappings = config["SPREADSHEET_OUT_COLS"]
+    fields = evaluation_fields(mappings)
+    fields.update(party_fields(cols, mappings))
+    cache = Cache(config["CACHE"])
+    ra_rows = []
+    llm_rows = {}
+    for case_id, ra_case in ra_cases.items():
+        llm_results = find_cached_results(cache, case_id, mappings)
+        if llm_results is None:
+            logger.warning(f"No LLM results for {case_id}")
+            continue
+        try:
+            llm_rows[case_id] = llm_values(cols, mappings, fields, llm_results)
+        except Exception as e:
+            logger.warning(f"Can't parse LLM results for {case_id}: {e}")
+            continue
+        for ra_row in ra_case:
+            ra_rows.append(ra_row)
+    scored = [c for c in cols if c in fields]
+    ra = pd.DataFrame(ra_rows, columns=["id"] + cols).set_index("id")[scored]
+    llm = pd.DataFrame.from_dict(llm_rows, orient="index", columns=cols)
+    llm = llm.reindex(ra.index)[scored]
+    return ra, llm, {c: fields[c] for c in scored}
+
+
+def normalise(s: pd.Series) -> pd.Series:
+    """Lowercase, drop paragraph references and punctuation, squash spaces and
+    treat all of the ways of saying 'nothing' as an empty string"""
+    s = s.fillna("").astype(str).str.lower()
+    s = s.str.replace(PARA_REF_RE, " ", regex=True)
+    s = s.str.replace(PUNCT_RE, " ", regex=True)
+    s = s.str.replace(r"\s+", " ", regex=True).str.strip()
+    return s.where(~s.isin(MISSING), "")
+
+
+def parse_dates(s: pd.Series) -> pd.Series:
+    """Find the first date in each value. Dates from the spreadsheet might
+    already be datetimes; strings can be ISO or Australian day-first."""
+    as_str = s.map(lambda v: v.isoformat() if hasattr(v, "isoformat") else v)
+    found = as_str.fillna("").astype(str).str.extract(DATE_RE, expand=False)
+    iso = found.str.match(r"\d{4}-", na=False)
+    dates = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    dates[iso] = pd.to_datetime(found[iso], errors="coerce", format="%Y-%m-%d")
+    dates[~iso] = pd.to_datetime(found[~iso], errors="coerce", dayfirst=True)
+    return dates.dt.normalize()
+
+
+def party_counts(df: pd.DataFrame, party_type: str) -> pd.Series:
+    """The number of parties of a type in each row, counting a party as
+    present if any of its columns has a value"""
+    numbers = {}
+    for col in df.columns:
+        if col.startswith(party_type + "_"):
+            n = col.split("_")[1]
+            present = normalise(df[col]) != ""
+            numbers[n] = numbers.get(n, False) | present
+    if not numbers:
+        return pd.Series(0, index=df.index)
+    return pd.DataFrame(numbers).sum(axis=1)
+
+
+def score(ra: pd.DataFrame, llm: pd.DataFrame, fields: dict) -> pd.DataFrame:
+    """Returns a table with a row per field and the agreement rates between
+    the RA and the LLM over all cases:
+
+    exact: the values are identical
+    normalised: the values are the same after normalise()
+    date: for fields with 'date' in their name, the values contain the same
+    date"""
+    rows = []
+    for col, (prompt, _) in fields.items():
+        ra_col = ra[col].fillna("").astype(str).str.strip()
+        llm_col = llm[col].fillna("").astype(str).str.strip()
+        row = {
+            "field": col,
+            "prompt": prompt,
+            "n": len(ra_col),
+            "exact": (ra_col == llm_col).mean(),
+            "normalised": (normalise(ra[col]) == normalise(llm[col])).mean(),
+            "date": float("nan"),
+        }
+        if "date" in col:
+            ra_dates = parse_dates(ra[col])
+            llm_dates = parse_dates(llm[col])
+            both_missing = ra_dates.isna() & llm_dates.isna()
+            row["date"] = ((ra_dates == llm_dates) | both_missing).mean()
+        rows.append(row)
+    for party_type in PARTY_TYPES:
+        ra_n = party_counts(ra, party_type)
+        llm_n = party_counts(llm, party_type)
+        rows.append(
+            {
+                "field": f"{party_type}_count",
+                "prompt": "parties",
+                "n": len(ra_n),
+                "exact": (ra_n == llm_n).mean(),
+                "normalised": (ra_n == llm_n).mean(),
+                "date": float("nan"),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def by_prompt(field_scores: pd.DataFrame) -> pd.DataFrame:
+    """Averages the field scores for each prompt"""
+    return field_scores.groupby("prompt")[["exact", "normalised", "date"]].mean()
+
+
+def evaluate():
+    ap = argparse.ArgumentParser("evaluate-langchain")
+    ap.add_argument(
+        "--config",
+        default="./collate_config.json",
+        type=Path,
+        help="Config file",
+    )
+    ap.add_argument(
+        "--cases",
+        default="",
+        type=str,
+        help="Comma-separated case IDs to evaluate (default is all of them)",
+    )
+    args = ap.parse_args()
+    cf = load_config(args.config)
+    case_ids = [c for c in args.cases.split(",") if c] or None
+    ra, llm, fields = align(cf, case_ids)
+    field_scores = score(ra, llm, fields)
+    prompt_scores = by_prompt(field_scores)
+    print(prompt_scores.to_string(float_format="{:.2f}".format))
+    output = cf.get("EVALUATION_OUT", "evaluation.xlsx")
+    with pd.ExcelWriter(output) as writer:
+        prompt_scores.to_excel(writer, sheet_name="prompts")
+        field_scores.to_excel(writer, sheet_name="fields", index=False)
+    logger.warning(f"Wrote {len(ra.index.unique())} cases' scores to {output}")
+
+
+if __name__ == "__main__":
+    evaluate()
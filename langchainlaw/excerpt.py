@@ -0,0 +1,107 @@
+import math
+import re
+from collections import Counter
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# crude stemming so that 'filed', 'filing' and 'file' all match
+SUFFIXES = ["ing", "ed", "es", "s", "e"]
+
+STOPWORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "did",
+    "does",
+    "for",
+    "from",
+    "has",
+    "have",
+    "if",
+    "in",
+    "is",
+    "it",
+    "of",
+    "on",
+    "or",
+    "that",
+    "the",
+    "this",
+    "to",
+    "was",
+    "were",
+    "what",
+    "which",
+    "who",
+    "with",
+}
+
+
+def stem(word: str) -> str:
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenise(text: str) -> list[str]:
+    return [stem(w) for w in WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+
+
+def split_paragraphs(text: str) -> list[str]:
+    """Splits judgment text into paragraphs on line breaks, dropping blank
+    lines"""
+    return [p.strip() for p in text.splitlines() if p.strip()]
+
+
+class BM25:
+    """Okapi BM25 ranking over a list of tokenised documents"""
+
+    def __init__(self, docs: list[list[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.tfs = [Counter(doc) for doc in docs]
+        self.lengths = [len(doc) for doc in docs]
+        self.avg_length = sum(self.lengths) / len(docs) if docs else 0
+        df = Counter(word for doc in docs for word in set(doc))
+        n = len(docs)
+        self.idf = {w: math.log(1 + (n - f + 0.5) / (f + 0.5)) for w, f in df.items()}
+
+    def scores(self, query: list[str]) -> list[float]:
+        query = set(query)
+        scores = []
+        for tf, length in zip(self.tfs, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.avg_length or 1))
+            score = 0.0
+            for word in query:
+                if word in tf:
+                    f = tf[word]
+                    score += self.idf[word] * f * (self.k1 + 1) / (f + norm)
+            scores.append(score)
+        return scores
+
+
+class JudgmentIndex:
+    """A BM25 index of the paragraphs of one judgment, built once per case
+    and used to pick out the paragraphs relevant to each prompt"""
+
+    def __init__(self, text: str):
+        self.paragraphs = split_paragraphs(text)
+        self.bm25 = BM25([tokenise(p) for p in self.paragraphs])
+
+    def top(self, query: str, k: int) -> list[str]:
+        """The k paragraphs which best match the query, in the order they
+        appear in the judgment"""
+        if len(self.paragraphs) <= k:
+            return self.paragraphs
+        scores = self.bm25.scores(tokenise(query))
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        return [self.paragraphs[i] for i in sorted(ranked[:k])]
+
+    def excerpt(self, query: str, k: int) -> str:
+        return "\n".join(self.top(query, k))
@@ -0,0 +1,77 @@
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from langchainlaw.providers import TransientError
+
+QUANTILE = 0.95
+MIN_SAMPLES = 20
+HISTORY = 200
+
+
+class DeadlineExceeded(TransientError):
+    """A request to the LLM took longer than the deadline"""
+
+
+class LatencyTracker:
+    """Keeps the most recent request latencies for each prompt so that slow
+    requests can be spotted. Safe to share between threads."""
+
+    def __init__(self, quantile: float = QUANTILE, min_samples: int = MIN_SAMPLES):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def add(self, prompt: str, seconds: float):
+        with self.lock:
+            self.latencies.setdefault(prompt, deque(maxlen=HISTORY)).append(seconds)
+
+    def threshold(self, prompt: str) -> float:
+        """The latency quantile for a prompt, or None until there have been
+        min_samples requests"""
+        with self.lock:
+            latencies = sorted(self.latencies.get(prompt, []))
+        if len(latencies) < self.min_samples:
+            return None
+        i = math.ceil(self.quantile * len(latencies)) - 1
+        return latencies[min(i, len(latencies) - 1)]
+
+
+def run_in_thread(fn, *args, **kwargs) -> Future:
+    """Run a function on a daemon thread and return a Future for its result.
+    Unlike a ThreadPoolExecutor, a request which never returns won't stop the
+    program from exiting."""
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def target():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def first_valid(futures: list[Future], valid, timeout: float = None):
+    """Wait for the first of the futures to return a result which passes
+    valid(), and return (future, result). If none of them does, the first
+    one's result is returned or its exception raised. Raises
+    DeadlineExceeded if nothing valid arrives within timeout seconds."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pending = set(futures)
+    while pending:
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"no response after {timeout:.1f} seconds")
+        for future in futures:
+            if future in done and future.exception() is None:
+                if valid(future.result()):
+                    return future, future.result()
+    first = futures[0]
+    return first, first.result()
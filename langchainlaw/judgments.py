@@ -0,0 +1,63 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# default memory cap for loaded judgments, in megabytes
+JUDGMENT_CACHE_MB = 256
+
+
+def file_hash(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()
+
+
+class JudgmentCache:
+    """LRU cache of loaded judgments keyed by a hash of the casefile, so that
+    a judgment which is loaded again in the same run (by the scheduler, a
+    rerun of one prompt or a notebook) isn't parsed and re-serialised. Each
+    entry is the parsed judgment and the encoded judgment text for the
+    prompts. The least recently used entries are dropped when the total size
+    goes over max_bytes. Safe to share between threads."""
+
+    def __init__(self, max_bytes: int = JUDGMENT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[dict, str]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            judgment, encoded, _ = self.entries[key]
+            return judgment, encoded
+
+    def put(self, key: str, judgment: dict, encoded: str, size: int):
+        """Add an entry. size is the approximate number of bytes it holds."""
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[2]
+            self.entries[key] = (judgment, encoded, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, dropped) = self.entries.popitem(last=False)
+                self.size -= dropped
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+def read_casefile(casefile: Path) -> tuple[str, bytes]:
+    """Returns the hash and the raw contents of a casefile"""
+    with open(casefile, "rb") as fh:
+        raw = fh.read()
+    return file_hash(raw), raw
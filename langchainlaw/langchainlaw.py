@@ -4,6 +4,10 @@ from pathlib import Path
 from openpyxl import Workbook
 
 from langchainlaw.classifier import Classifier
+from langchainlaw.dryrun import dry_run, size_report
+from langchainlaw.progress import make_progress
+from langchainlaw.store import ResultsStore
+from langchainlaw.scheduler import Scheduler, WINDOW, estimate_work, run_schedule
 
 
 def cli():
@@ -20,6 +24,18 @@ def cli():
         default=False,
         help="Generate prompts and write them out as text but don't call the LLM",
     )
+    ap.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        help="Render every case and prompt and report sizes, costs and timing",
+    )
+    ap.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of processes for --dry-run (default is one per CPU)",
+    )
     ap.add_argument(
         "--case",
         default="",
@@ -38,6 +54,48 @@ def cli():
         default=False,
         help="Ignore cached results, always call the LLM",
     )
+    ap.add_argument(
+        "--schedule",
+        action="store_true",
+        default=False,
+        help="Order requests by priority and pack them under tokens_per_minute",
+    )
+    ap.add_argument(
+        "--budget-tokens",
+        default=None,
+        type=int,
+        help="Stop scheduling requests after this many estimated tokens",
+    )
+    ap.add_argument(
+        "--budget-cost",
+        default=None,
+        type=float,
+        help="Stop scheduling requests after this many estimated dollars",
+    )
+    ap.add_argument(
+        "--priority-prompts",
+        default="",
+        type=str,
+        help="Comma-separated prompt names to run first",
+    )
+    ap.add_argument(
+        "--priority-cases",
+        default="",
+        type=str,
+        help="Comma-separated case filenames to run first",
+    )
+    ap.add_argument(
+        "--progress",
+        action="store_true",
+        default=False,
+        help="Show a progress line with throughput and ETA instead of logging",
+    )
+    ap.add_argument(
+        "--metrics-port",
+        default=None,
+        type=int,
+        help="Serve Prometheus metrics on this local port at /metrics",
+    )
 
     args = ap.parse_args()
 
@@ -75,20 +133,90 @@ def cli():
             return
         cases = [case]
     else:
-        cases = Path(config["input"]).glob("*.json")
+        cases = list(Path(config["input"]).glob("*.json"))
+
+    if args.dry_run:
+        items = dry_run(config, cases, prompt_filter, args.workers)
+        print(
+            size_report(
+                items, classifier.rate_limit, config.get("tokens_per_minute", None)
+            )
+        )
+        return
 
-    for casefile in cases:
-        results = classifier.classify(
-            casefile, test=args.test, prompts=prompt_filter, no_cache=args.no_cache
+    if args.progress or args.metrics_port:
+        n_prompts = len(prompt_filter or classifier.prompt_names)
+        classifier.progress = make_progress(
+            len(cases) * n_prompts, show=args.progress, port=args.metrics_port
         )
+        if args.progress:
+            classifier.quiet = True
+
+    store = None
+    if config.get("results_store"):
+        store = ResultsStore(config["results_store"], classifier.headers)
+
+    def add_results(results):
         cols = classifier.as_columns(results)
         worksheet.append(cols)
+        if store is not None:
+            store.append(dict(zip(classifier.headers, cols)))
+
+    if (
+        args.schedule
+        or args.budget_tokens is not None
+        or args.budget_cost is not None
+        or args.priority_prompts
+        or args.priority_cases
+    ):
+        scheduled = schedule(classifier, config, args, cases, prompt_filter)
+        for results in scheduled.values():
+            add_results(results)
+    else:
+        for casefile in cases:
+            results = classifier.classify(
+                casefile, test=args.test, prompts=prompt_filter, no_cache=args.no_cache
+            )
+            add_results(results)
+
+    if classifier.progress:
+        classifier.progress.finish()
+
+    if classifier.stats:
+        print(", ".join(f"{k}: {v}" for k, v in sorted(classifier.stats.items())))
+
+    if store is not None:
+        store.close()
+        print(f"Wrote results to {store.dir}")
+
+    if classifier.cache:
+        classifier.cache.flush()
 
     spreadsheet = config.get("output", "results.xlsx")
     print(f"Writing results to {spreadsheet}")
     workbook.save(spreadsheet)
 
 
+def schedule(classifier, config, args, cases, prompt_filter):
+    """Estimate the tokens for every request, then run them in priority order
+    within the budget and the tokens per minute limit"""
+    items = estimate_work(classifier, cases, prompt_filter, no_cache=args.no_cache)
+    rpm = None
+    if classifier.rate_limit:
+        rpm = max(1, int(WINDOW / classifier.rate_limit))
+    scheduler = Scheduler(
+        items,
+        max_tokens=args.budget_tokens,
+        max_cost=args.budget_cost,
+        prompt_priority=[p for p in args.priority_prompts.split(",") if p],
+        case_priority=[c for c in args.priority_cases.split(",") if c],
+        tokens_per_minute=config.get("tokens_per_minute", None),
+        requests_per_minute=rpm,
+    )
+    print(scheduler.summary())
+    return run_schedule(classifier, scheduler.windows(), no_cache=args.no_cache)
+
+
 def dump_prompts(classifier, config):
     """Writes the prompts which would be sent to the LLM to a text file"""
 
@@ -0,0 +1,206 @@
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from openpyxl import Workbook, load_workbook
+
+from langchainlaw.classifier import Classifier
+from langchainlaw.progress import Progress
+
+DEFAULT_CASES = 1000
+DEFAULT_CONCURRENCY = 8
+
+# a moderately degraded provider, used if the config has no loadtest section
+DEFAULT_FAULTS = {
+    "latency": {"type": "lognormal", "median": 0.01, "sigma": 1.0},
+    "error_rate": 0.02,
+    "rate_limit_rate": 0.005,
+    "burst_length": 5,
+    "truncate_rate": 0.01,
+    "malformed_rate": 0.01,
+}
+
+PARAGRAPH = (
+    "{n} The plaintiff seeks provision out of the estate of the deceased under"
+    " s 59 of the Succession Act 2006 (NSW). The summons was filed on"
+    " {day}/{month}/2020 and the defendant is the executor of the will."
+)
+
+
+def synthetic_judgments(n: int):
+    """Generates n synthetic judgments with a few numbered paragraphs each"""
+    for i in range(n):
+        text = "\n".join(
+            PARAGRAPH.format(n=p, day=1 + i % 28, month=1 + p % 12)
+            for p in range(1, 1 + 5 + i % 20)
+        )
+        yield {
+            "id": f"load{i:06d}",
+            "title": f"Synthetic v Case {i}",
+            "mnc": f"[2020] NSWSC {i}",
+            "judgment": text,
+        }
+
+
+def as_cell(value) -> str:
+    return "" if value is None else str(value)
+
+
+def check_cache(classifier: Classifier, case_ids: list[str]) -> dict[str, int]:
+    """Counts the cache entries which are the mock's answer, are something
+    else (a truncated or malformed response which was cached) or are missing"""
+    counts = {"correct": 0, "wrong": 0, "missing": 0}
+    for case_id in case_ids:
+        for prompt in classifier.next_prompt():
+            response = classifier.cache.load(case_id, prompt.name)
+            if response is None:
+                counts["missing"] += 1
+            elif response == prompt.mock_response():
+                counts["correct"] += 1
+            else:
+                counts["wrong"] += 1
+    return counts
+
+
+def check_spreadsheet(classifier: Classifier, spreadsheet: Path) -> dict[str, int]:
+    """Counts the rows of the results spreadsheet which have the values the
+    mock should give"""
+    results = {"file": "", "mnc": ""}
+    for prompt in classifier.next_prompt():
+        results[prompt.name] = prompt.parse_response(prompt.mock_response())
+    expected = [as_cell(v) for v in classifier.as_columns(results)[2:]]
+    counts = {"rows": 0, "correct": 0}
+    workbook = load_workbook(spreadsheet, read_only=True)
+    rows = workbook.active.iter_rows(min_row=2, values_only=True)
+    for row in rows:
+        counts["rows"] += 1
+        if [as_cell(v) for v in row[2:]] == expected:
+            counts["correct"] += 1
+    workbook.close()
+    return counts
+
+
+def run_loadtest(
+    config: dict,
+    cases: int = DEFAULT_CASES,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    outdir: Path = None,
+    show: bool = True,
+) -> dict:
+    """Drive synthetic cases through Classifier.classify_many against the
+    mock LLM wrapped in a FaultyProvider, then check the cache and the
+    results spreadsheet. The faults come from the config's loadtest section.
+    Returns a report as a dict."""
+    outdir = Path(outdir or tempfile.mkdtemp(prefix="loadtest"))
+    outdir.mkdir(parents=True, exist_ok=True)
+    cf = dict(config)
+    faults = config.get("loadtest", DEFAULT_FAULTS)
+    cf["providers"] = {
+        "faulty": {"type": "faulty", "wraps": {"type": "mock"}, **faults}
+    }
+    cf["provider"] = "faulty"
+    cf["rate_limit"] = config.get("loadtest_rate_limit", 0)
+    cf["cache"] = str(outdir / "cache")
+    classifier = Classifier(cf, quiet=True)
+    classifier.load_prompts(cf["prompts"])
+    n_prompts = len(classifier.prompt_names)
+    classifier.progress = Progress(
+        cases * n_prompts, stream=sys.stderr if show else None
+    )
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(classifier.headers)
+    case_ids = []
+    started = time.monotonic()
+    judgments = synthetic_judgments(cases)
+    for case_id, results in classifier.classify_many(judgments, concurrency):
+        worksheet.append(classifier.as_columns(results))
+        case_ids.append(case_id)
+    elapsed = time.monotonic() - started
+    classifier.progress.finish()
+    spreadsheet = outdir / "results.xlsx"
+    workbook.save(spreadsheet)
+    classifier.cache.flush()
+
+    progress = classifier.progress
+    return {
+        "output": str(outdir),
+        "cases": len(case_ids),
+        "prompts": progress.done,
+        "seconds": elapsed,
+        "prompts_per_second": progress.done / elapsed if elapsed else 0,
+        "requests": progress.requests,
+        "retries": classifier.stats["retries"],
+        "failed": progress.counts["failed"],
+        "faults": dict(classifier.llm.faults),
+        "stats": dict(classifier.stats),
+        "cache": check_cache(classifier, case_ids),
+        "spreadsheet": check_spreadsheet(classifier, spreadsheet),
+    }
+
+
+def format_report(report: dict) -> str:
+    cache = report["cache"]
+    sheet = report["spreadsheet"]
+    faults = ", ".join(f"{k} {v}" for k, v in report["faults"].items())
+    return "\n".join(
+        [
+            f"Cases: {report['cases']} ({report['prompts']} prompts)",
+            f"Time: {report['seconds']:.1f}s"
+            f" ({report['prompts_per_second']:.1f} prompts/s)",
+            f"Requests: {report['requests']}, retries: {report['retries']}",
+            f"Hedged: {report['stats'].get('hedged', 0)}"
+            f" ({report['stats'].get('hedge_won', 0)} won),"
+            f" deadlines exceeded: {report['stats'].get('deadline_exceeded', 0)}",
+            f"Injected faults: {faults}",
+            f"Failed prompts: {report['failed']}",
+            f"Cache: {cache['correct']} correct, {cache['wrong']} wrong,"
+            f" {cache['missing']} missing",
+            f"Spreadsheet: {sheet['correct']} of {sheet['rows']} rows correct",
+            f"Output in {report['output']}",
+        ]
+    )
+
+
+def cli():
+    ap = argparse.ArgumentParser("loadtest-langchain")
+    ap.add_argument(
+        "--config",
+        default="./config.json",
+        type=Path,
+        help="Config file - only the prompts and any loadtest section are used",
+    )
+    ap.add_argument(
+        "--cases",
+        default=DEFAULT_CASES,
+        type=int,
+        help="Number of synthetic cases",
+    )
+    ap.add_argument(
+        "--concurrency",
+        default=DEFAULT_CONCURRENCY,
+        type=int,
+        help="Number of cases to classify at once",
+    )
+    ap.add_argument(
+        "--output",
+        default=None,
+        type=Path,
+        help="Directory for the cache and spreadsheet (default is a temp dir)",
+    )
+    args = ap.parse_args()
+    with open(args.config, "r") as cfh:
+        config = json.load(cfh)
+    if args.output and (args.output / "cache").exists():
+        print(f"{args.output} already has a cache - use a new directory")
+        return
+    report = run_loadtest(config, args.cases, args.concurrency, args.output)
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import re
+from pathlib import Path
+
+from langchainlaw.cache import Cache, write_json
+from langchainlaw.excerpt import split_paragraphs
+from langchainlaw.judgments import read_casefile
+
+# bump this when the output of compact_text changes, so that old artifacts
+# are rebuilt
+VERSION = 2
+
+# kept apart from the case directories, which only hold LLM responses
+PREPROCESSED_DIR = ".preprocessed"
+
+MONTHS = (
+    "January|February|March|April|May|June|July|August|September|October"
+    "|November|December|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sept|Sep|Oct|Nov|Dec"
+)
+
+# a paragraph number, or one which has already been labelled, but not the day
+# at the start of a date
+PARA_NUMBER_RE = re.compile(rf"^\[?(\d+)\]?\.?\s+(?!(?:{MONTHS})\b)(.*)$")
+
+# the judgment's own numbers are used if more than this fraction of its
+# paragraphs are numbered, even if they aren't in sequence
+NUMBERED_MAJORITY = 2 / 3
+SPACE_RE = re.compile(r"[ \t ]+")
+
+# fields which the LLM never needs
+SKIP_FIELDS = ["uri"]
+
+
+def squash(text: str) -> str:
+    return SPACE_RE.sub(" ", text).strip()
+
+
+def own_numbers(paragraphs: list[str], matches: list) -> bool:
+    """Whether the numbers at the start of paragraphs are the judgment's own
+    paragraph numbers: they count up one at a time, or most paragraphs have
+    one. A single number is more likely to be the start of a sentence like
+    '2019 was...'"""
+    numbers = [int(m.group(1)) for m in matches if m]
+    if len(numbers) < 2:
+        return False
+    if all(b == a + 1 for a, b in zip(numbers, numbers[1:])):
+        return True
+    return len(numbers) > NUMBERED_MAJORITY * len(paragraphs)
+
+
+def number_paragraphs(text: str) -> list[str]:
+    """Splits judgment text into paragraphs labelled [n] to match the (pn)
+    references the prompts ask for. If the judgment numbers its own
+    paragraphs those numbers are kept, and unnumbered lines like headings are
+    left as they are; otherwise every paragraph is numbered in order."""
+    paragraphs = [squash(p) for p in split_paragraphs(text)]
+    matches = [PARA_NUMBER_RE.match(p) for p in paragraphs]
+    if not own_numbers(paragraphs, matches):
+        return [f"[{i}] {p}" for i, p in enumerate(paragraphs, start=1)]
+    return [
+        f"[{m.group(1)}] {m.group(2)}" if m else p for p, m in zip(paragraphs, matches)
+    ]
+
+
+def compact_text(
+    judgment: dict,
+    field: str = "judgment",
+    skip: list[str] = None,
+    numbered: bool = False,
+) -> str:
+    """Renders a judgment as plain text: one 'key: value' line for each
+    non-empty metadata field, then the paragraph-numbered judgment text.
+    This is much shorter than the JSON encoding, which escapes every line
+    break, quote and non-ASCII character. If numbered is set, the text has
+    already been through number_paragraphs (like an excerpt) and is kept as
+    it is."""
+    skip = SKIP_FIELDS if skip is None else skip
+    lines = []
+    for key, value in judgment.items():
+        if key == field or key in skip or value in (None, "", [], {}):
+            continue
+        if type(value) is not str:
+            value = json.dumps(value, ensure_ascii=False)
+        lines.append(f"{key}: {squash(value)}")
+    if judgment.get(field):
+        lines.append("")
+        if numbered:
+            lines.append(judgment[field])
+        else:
+            lines.extend(number_paragraphs(judgment[field]))
+    return "\n".join(lines)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def artifact_paths(cache: Cache, case_id: str) -> tuple[Path, Path]:
+    """The preprocessed text of a case and the JSON file describing it"""
+    directory = Path(cache.root) / PREPROCESSED_DIR
+    return directory / f"{case_id}.txt", directory / f"{case_id}.json"
+
+
+def load_artifact(
+    cache: Cache, case_id: str, source: str, field: str = "judgment"
+) -> str:
+    """Returns the preprocessed text for a case from the cache directory, or
+    None if there isn't one for this version of the casefile and of the
+    preprocessing, made from the same judgment field"""
+    text_file, info_file = artifact_paths(cache, case_id)
+    try:
+        with open(info_file, "r") as fh:
+            info = json.load(fh)
+        with open(text_file, "r", encoding="utf-8") as fh:
+            text = fh.read()
+    except (OSError, ValueError):
+        return None
+    if info.get("source") != source or info.get("version") != VERSION:
+        return None
+    if info.get("field") != field:
+        return None
+    if info.get("hash") != content_hash(text):
+        return None
+    return text
+
+
+def save_artifact(
+    cache: Cache, case_id: str, source: str, text: str, field: str = "judgment"
+):
+    """Saves the preprocessed text for a case in the cache directory, with
+    the hash of the casefile it came from and of the text itself, and the
+    judgment field it was made from"""
+    text_file, info_file = artifact_paths(cache, case_id)
+    text_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(text_file, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    info = {
+        "source": source,
+        "version": VERSION,
+        "field": field,
+        "hash": content_hash(text),
+        "chars": len(text),
+    }
+    write_json(info_file, info)
+
+
+def preprocess_casefiles(
+    cache: Cache, casefiles: list[Path], field: str = "judgment"
+) -> dict[str, int]:
+    """Builds the preprocessed text for every casefile which doesn't have an
+    up-to-date one. Returns counts of artifacts built and reused and the
+    characters in the JSON and compact versions of the judgments."""
+    counts = {"built": 0, "reused": 0, "json_chars": 0, "text_chars": 0}
+    for casefile in casefiles:
+        source, raw = read_casefile(casefile)
+        judgment = json.loads(raw)
+        text = load_artifact(cache, casefile.stem, source, field)
+        if text is None:
+            text = compact_text(judgment, field)
+            save_artifact(cache, casefile.stem, source, text, field)
+            counts["built"] += 1
+        else:
+            counts["reused"] += 1
+        counts["json_chars"] += len(json.dumps(judgment))
+        counts["text_chars"] += len(text)
+    return counts
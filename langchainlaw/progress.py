@@ -0,0 +1,188 @@
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WINDOW = 60
+OUTCOMES = ["completed", "cached", "failed"]
+
+
+class Progress:
+    """Counts the (case, prompt) pairs finished in a run and the requests and
+    tokens sent to the LLM, with rates over a rolling window. Safe to share
+    between threads.
+
+    completed: answered by the LLM
+    cached: answered from the cache (or the mock in test mode)
+    failed: the LLM raised an error, or its response couldn't be parsed"""
+
+    def __init__(self, total: int = None, window: float = WINDOW, stream=None):
+        self.total = total
+        self.window = window
+        self.stream = stream
+        self.counts = {outcome: 0 for outcome in OUTCOMES}
+        self.requests = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+        self.recent_requests = deque()
+        self.recent_pairs = deque()
+        self.lock = threading.Lock()
+
+    def _trim(self, recent: deque, now: float):
+        while recent and recent[0][0] < now - self.window:
+            recent.popleft()
+
+    def record(self, outcome: str):
+        """Count a (case, prompt) pair as completed, cached or failed"""
+        if outcome not in self.counts:
+            raise ValueError(f"Unknown outcome {outcome}")
+        with self.lock:
+            self.counts[outcome] += 1
+            self.recent_pairs.append((time.monotonic(), 1))
+        self.show()
+
+    def request(self, usage: dict = None):
+        """Count one request to the LLM and the tokens it used"""
+        tokens = (usage or {}).get("total_tokens", 0)
+        with self.lock:
+            self.requests += 1
+            self.tokens += tokens
+            self.recent_requests.append((time.monotonic(), tokens))
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    @property
+    def queued(self) -> int:
+        """The number of pairs still to do, or None if the total isn't known"""
+        if self.total is None:
+            return None
+        return max(0, self.total - self.done)
+
+    def rates(self) -> tuple[float, float, float]:
+        """Requests, tokens and pairs per minute over the rolling window (or
+        since the start, if that's shorter)"""
+        with self.lock:
+            now = time.monotonic()
+            self._trim(self.recent_requests, now)
+            self._trim(self.recent_pairs, now)
+            minutes = min(self.window, max(now - self.started, 1e-6)) / 60
+            requests = len(self.recent_requests) / minutes
+            tokens = sum(t for _, t in self.recent_requests) / minutes
+            pairs = len(self.recent_pairs) / minutes
+        return requests, tokens, pairs
+
+    def eta(self) -> float:
+        """Estimated seconds until the run finishes, or None"""
+        queued = self.queued
+        if queued is None:
+            return None
+        _, _, pairs = self.rates()
+        if pairs == 0:
+            return None if queued else 0.0
+        return queued / pairs * 60
+
+    def render(self) -> str:
+        requests, tokens, _ = self.rates()
+        total = "?" if self.total is None else self.total
+        eta = self.eta()
+        eta = "--:--" if eta is None else format_seconds(eta)
+        return (
+            f"{self.done}/{total} "
+            f"(completed {self.counts['completed']}, "
+            f"cached {self.counts['cached']}, failed {self.counts['failed']}) "
+            f"{requests:.1f} req/min {tokens:.0f} tok/min ETA {eta}"
+        )
+
+    def show(self):
+        """Redraw the progress line, if there's a stream to draw it on"""
+        if self.stream is not None:
+            self.stream.write("\r" + self.render())
+            self.stream.flush()
+
+    def finish(self):
+        if self.stream is not None:
+            self.show()
+            self.stream.write("\n")
+
+    def metrics(self) -> str:
+        """The counters and rates in Prometheus text format"""
+        requests, tokens, _ = self.rates()
+        lines = [
+            "# HELP langchainlaw_prompts_total Case prompts finished by outcome",
+            "# TYPE langchainlaw_prompts_total counter",
+        ]
+        for outcome, count in self.counts.items():
+            lines.append(f'langchainlaw_prompts_total{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP langchainlaw_requests_total Requests sent to the LLM",
+            "# TYPE langchainlaw_requests_total counter",
+            f"langchainlaw_requests_total {self.requests}",
+            "# HELP langchainlaw_tokens_total Tokens used by LLM requests",
+            "# TYPE langchainlaw_tokens_total counter",
+            f"langchainlaw_tokens_total {self.tokens}",
+            "# HELP langchainlaw_requests_per_minute Rolling request rate",
+            "# TYPE langchainlaw_requests_per_minute gauge",
+            f"langchainlaw_requests_per_minute {requests:.3f}",
+            "# HELP langchainlaw_tokens_per_minute Rolling token rate",
+            "# TYPE langchainlaw_tokens_per_minute gauge",
+            f"langchainlaw_tokens_per_minute {tokens:.3f}",
+        ]
+        if self.total is not None:
+            lines += [
+                "# HELP langchainlaw_queue_depth Case prompts still to do",
+                "# TYPE langchainlaw_queue_depth gauge",
+                f"langchainlaw_queue_depth {self.queued}",
+            ]
+        eta = self.eta()
+        if eta is not None:
+            lines += [
+                "# HELP langchainlaw_eta_seconds Estimated time to finish",
+                "# TYPE langchainlaw_eta_seconds gauge",
+                f"langchainlaw_eta_seconds {eta:.1f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def serve_metrics(progress: Progress, port: int, host: str = "127.0.0.1"):
+    """Serve progress.metrics() at /metrics on a background thread. Returns
+    the server so that it can be shut down."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = progress.metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def make_progress(total: int = None, show: bool = True, port: int = None):
+    """Progress for a command line run: drawn on stderr if show is set and
+    exported on a local port if there is one"""
+    progress = Progress(total, stream=sys.stderr if show else None)
+    if port:
+        serve_metrics(progress, port)
+    return progress
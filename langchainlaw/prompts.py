@@ -1,9 +1,24 @@
+from collections import Counter
 from dataclasses import dataclass, field
+import hashlib
 import json
+import math
 import random
 import re
 
 JSON_QUOTE_RE = re.compile("```json(.*)```")
+JSON_OPEN_RE = re.compile("```json(.*)")
+
+# paragraph references like (p7) or (pp12-13) which the LLM adds to answers
+PARA_REF_RE = r"\(pp?\s*\d+(?:\s*-\s*\d+)?\)"
+
+# rough rule of thumb for English text with OpenAI's tokenisers
+CHARS_PER_TOKEN = 4
+
+# the output token limit for a prompt is this many times the size of its
+# example response, to allow for longer answers and paragraph references
+MAX_TOKENS_MARGIN = 3
+MIN_MAX_TOKENS = 256
 
 # types for annotations - NOTE - these don't typecheck with mypy
 
@@ -23,8 +38,25 @@ def parse_llm_json(llm_json: str):
     if match:
         json_raw = match.group(1)
         return json.loads(json_raw)
-    else:
-        return json.loads(llm_json)
+    # the closing fence is missing from a truncated answer, or from a
+    # continued one which was cut off again
+    match = JSON_OPEN_RE.search(llm_oneline)
+    if match:
+        return json.loads(match.group(1))
+    return json.loads(llm_json)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a string without a tokeniser"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def canonical(value) -> str:
+    """A normalised form of an answer for voting. Paragraph references are
+    dropped, so that answers which cite different paragraphs agree."""
+    if type(value) is not str:
+        value = json.dumps(value, sort_keys=True)
+    return re.sub(r"\s*" + PARA_REF_RE, "", value).strip().lower()
 
 
 class PromptException(Exception):
@@ -54,6 +86,10 @@ class CasePrompt:
     fields: list[CasePromptField] = field(default_factory=list)
     additional_instruction: str = None
     repeats: int = 1
+    provider: str = None
+    samples: int = 1
+    excerpt: int = None
+    max_tokens: int = None
 
     @property
     def headers(self) -> list[str]:
@@ -69,6 +105,50 @@ class CasePrompt:
             else:
                 return [f"{self.name}:{f.field}" for f in self.fields]
 
+    @property
+    def fingerprint(self) -> str:
+        """A short hash of everything which defines the prompt, so that cached
+        responses can be matched to the version of the prompt which made them.
+        (The prompt text itself can't be used as it has random paragraph
+        numbers in the examples.)"""
+        definition = json.dumps(
+            [
+                self.name,
+                self.question,
+                self.return_instruction,
+                self.return_type,
+                self.additional_instruction,
+                self.repeats,
+                [[f.field, f.question, f.example_response] for f in self.fields],
+            ]
+            + ([self.excerpt] if self.excerpt else [])
+        )
+        return hashlib.sha1(definition.encode("utf-8")).hexdigest()[:12]
+
+    @property
+    def output_tokens(self) -> int:
+        """Estimated tokens in a response: the length of the example
+        response, times the number of repeats for json_multiple prompts"""
+        return estimate_tokens(self.mock_response()) * self.repeats
+
+    @property
+    def token_limit(self) -> int:
+        """The most tokens the LLM may generate for this prompt: the
+        max_tokens from the spreadsheet if there is one, otherwise a multiple
+        of the expected response size. Text prompts have no limit unless the
+        spreadsheet sets one."""
+        if self.max_tokens:
+            return self.max_tokens
+        if self.return_type == "text":
+            return None
+        return max(MIN_MAX_TOKENS, self.output_tokens * MAX_TOKENS_MARGIN)
+
+    @property
+    def query(self) -> str:
+        """The text used to find the judgment paragraphs relevant to this
+        prompt when it's excerpted"""
+        return " ".join([self.question] + [f.question for f in self.fields])
+
     @property
     def prompt(self) -> str:
         prompt = f"      {self.question}\n\n"
@@ -93,16 +173,38 @@ class CasePrompt:
 
     def collimate(self, result: ResultsDict) -> FlatResultsDict:
         """Take a results set for this prompt and return an array of the
-        results as columns."""
+        results as columns, one for each of the prompt's headers. Errors and
+        responses which aren't the expected JSON go in the first column."""
         if self.fields is None:
             return [result]
-        if self.return_type == "json_multiple":
-            if result is None:
-                return ["" for _ in self.fields]
-            return [single.get(f.field) for single in result for f in self.fields]
+        width = len(self.headers)
         if result is None:
-            return ["" for _ in self.fields]
-        return [result.get(f.field) for f in self.fields]
+            return ["" for _ in range(width)]
+        if self.return_type == "json_multiple":
+            if type(result) is list and all(type(s) is dict for s in result):
+                if len(result) > self.repeats:
+                    print(
+                        f"[warning] prompt {self.name} returned {len(result)}"
+                        f" results, keeping the first {self.repeats}"
+                    )
+                cols = [
+                    single.get(f.field)
+                    for single in result[: self.repeats]
+                    for f in self.fields
+                ]
+            else:
+                cols = self.error_columns(result)
+        elif type(result) is dict:
+            cols = [result.get(f.field) for f in self.fields]
+        else:
+            cols = self.error_columns(result)
+        return (cols + ["" for _ in range(width)])[:width]
+
+    def error_columns(self, result) -> list[str]:
+        """Columns for an error from wrap_error or an unparseable response"""
+        if type(result) is list and all(type(c) is str for c in result):
+            return result
+        return [str(result)]
 
     def flatten(self, result: ResultsDict) -> FlatResultsDict:
         """Take a results set for this prompt and return a dict by either
@@ -118,6 +220,17 @@ class CasePrompt:
             }
         return {f"{self.name}:{f.field}": result.get(f.field) for f in self.fields}
 
+    def is_valid(self, response: str) -> bool:
+        """Whether a response can be parsed, without the warnings from
+        parse_response"""
+        if self.return_type == "text":
+            return True
+        try:
+            parse_llm_json(response)
+        except Exception:
+            return False
+        return True
+
     def parse_response(self, response: str):
         """Parses the string returned by the LLM, and also does some basic
         checking that the return types matched what the prompt expected"""
@@ -162,6 +275,94 @@ class CasePrompt:
             cols[0] = msg
             return cols
 
+    @property
+    def agreement_keys(self) -> list[str]:
+        """Sampled json prompts are voted on field by field, everything else
+        as a whole response"""
+        if self.return_type == "json":
+            return [f.field for f in self.fields]
+        return [self.name]
+
+    @property
+    def agreement_headers(self) -> list[str]:
+        if self.samples <= 1:
+            return []
+        if self.return_type == "json":
+            return [f"{self.name}:{f.field}:agreement" for f in self.fields]
+        return [f"{self.name}:agreement"]
+
+    def agreement_columns(self, agreement: dict[str, float]) -> list:
+        if self.samples <= 1:
+            return []
+        if agreement is None:
+            return ["" for _ in self.agreement_keys]
+        return [agreement.get(k, "") for k in self.agreement_keys]
+
+    def tally(self, responses: list[str]) -> dict[str, Counter]:
+        """Counts the votes for each answer in a set of sampled responses.
+        Answers are compared after lowercasing and stripping and without their
+        paragraph references, and JSON is compared by value. Returns a
+        Counter of answers by agreement key."""
+        votes = {k: Counter() for k in self.agreement_keys}
+        for response in responses:
+            try:
+                parsed = parse_llm_json(response)
+            except Exception:
+                parsed = response
+            if self.return_type == "json":
+                for f in self.fields:
+                    value = parsed.get(f.field) if type(parsed) is dict else None
+                    votes[f.field][canonical(value)] += 1
+            else:
+                votes[self.name][canonical(parsed)] += 1
+        return votes
+
+    def majority(self, responses: list[str]) -> bool:
+        """True if every answer has a majority of the samples, so that more
+        samples can't change the vote"""
+        return self.votes_needed(responses) == 0
+
+    def votes_needed(self, responses: list[str]) -> int:
+        """The fewest extra samples which could give every answer a majority"""
+        needed = self.samples // 2 + 1
+        votes = self.tally(responses)
+        return max(max(0, needed - max(v.values())) for v in votes.values())
+
+    def vote(self, responses: list[str]) -> tuple[str, dict[str, float]]:
+        """Takes the majority answer from a set of sampled responses. Returns
+        the winning response - for json prompts, built up from the winning
+        answer to each field - and the fraction of samples which agreed with
+        each winning answer."""
+        votes = self.tally(responses)
+        agreement = {
+            k: v.most_common(1)[0][1] / len(responses) for k, v in votes.items()
+        }
+        if self.return_type == "json":
+            winner = {}
+            for f in self.fields:
+                answer = votes[f.field].most_common(1)[0][0]
+                for response in responses:
+                    try:
+                        parsed = parse_llm_json(response)
+                    except Exception:
+                        continue
+                    if (
+                        type(parsed) is dict
+                        and canonical(parsed.get(f.field)) == answer
+                    ):
+                        winner[f.field] = parsed.get(f.field)
+                        break
+            return json.dumps(winner), agreement
+        answer = votes[self.name].most_common(1)[0][0]
+        for response in responses:
+            try:
+                parsed = parse_llm_json(response)
+            except Exception:
+                parsed = response
+            if canonical(parsed) == answer:
+                return response, agreement
+        return responses[0], agreement
+
     def mock_response(self):
         """returns string literals for JSON fields so that they can be parsed"""
         if self.fields is None:
@@ -0,0 +1,266 @@
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+import openai.error
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import AIMessage, BaseMessage
+
+from langchainlaw.prompts import CHARS_PER_TOKEN, CasePrompt, estimate_tokens
+
+DEFAULT_LOCAL_URL = "http://localhost:8080/v1"
+DEFAULT_LOCAL_KEY = "sk-no-key-required"
+
+
+class ProviderException(Exception):
+    pass
+
+
+class TransientError(ProviderException):
+    """An error which is worth retrying, like a rate limit or a timeout"""
+
+
+TRANSIENT_ERRORS = (
+    TransientError,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+
+def is_transient(e: Exception) -> bool:
+    return isinstance(e, TRANSIENT_ERRORS)
+
+
+@dataclass
+class ChatResponse:
+    """What a provider returns from a chat: the text of the reply, the
+    token usage if the backend reports it, and whether the reply was cut off
+    by max_tokens"""
+
+    content: str
+    usage: dict[str, int] = field(default_factory=dict)
+    truncated: bool = False
+
+
+class Provider:
+    """Base class for LLM backends. Each entry in the "providers" section of
+    the config is turned into one of these by make_provider"""
+
+    def __init__(self, name: str, config: dict, temperature: float = 0):
+        self.name = name
+        self.model = config.get("model", name)
+        self.temperature = temperature
+        # prices are in dollars per million tokens
+        self.input_price = config.get("input_price", 0)
+        self.output_price = config.get("output_price", 0)
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        """Estimated cost in dollars of a request"""
+        return (
+            input_tokens * self.input_price + output_tokens * self.output_price
+        ) / 1_000_000
+
+    def chat(
+        self,
+        messages: list[BaseMessage],
+        prompt: CasePrompt = None,
+        max_tokens: int = None,
+    ) -> ChatResponse:
+        """Send a list of messages and return the response, generating at
+        most max_tokens. The prompt is passed in for providers which need to
+        know what's being asked."""
+        raise NotImplementedError
+
+
+class OpenAIProvider(Provider):
+    """OpenAI, or any other HTTP service with an OpenAI-compatible chat API
+    if base_url is set in the config"""
+
+    def __init__(self, name: str, config: dict, temperature: float = 0):
+        super().__init__(name, config, temperature)
+        try:
+            self.llm = ChatOpenAI(
+                model_name=config["model"],
+                openai_api_key=config["api_key"],
+                openai_organization=config.get("organization", ""),
+                openai_api_base=config.get("base_url", ""),
+                temperature=temperature,
+            )
+        except KeyError as e:
+            raise ProviderException(f"Provider {name} needs a value for {e}")
+        self.limited = {}
+
+    def llm_for(self, max_tokens: int = None) -> ChatOpenAI:
+        """ChatOpenAI only takes max_tokens when it's created, so keep a copy
+        of the model for each limit"""
+        if max_tokens is None:
+            return self.llm
+        if max_tokens not in self.limited:
+            self.limited[max_tokens] = self.llm.copy(update={"max_tokens": max_tokens})
+        return self.limited[max_tokens]
+
+    def chat(
+        self,
+        messages: list[BaseMessage],
+        prompt: CasePrompt = None,
+        max_tokens: int = None,
+    ) -> ChatResponse:
+        result = self.llm_for(max_tokens).generate([messages])
+        generation = result.generations[0][0]
+        usage = dict((result.llm_output or {}).get("token_usage", {}))
+        # this version of langchain doesn't pass on the finish reason
+        truncated = bool(max_tokens) and usage.get("completion_tokens", 0) >= max_tokens
+        return ChatResponse(
+            content=generation.message.content, usage=usage, truncated=truncated
+        )
+
+
+class LocalProvider(OpenAIProvider):
+    """A model running on a local server with an OpenAI-compatible endpoint,
+    such as llama.cpp's server. No API key is needed."""
+
+    def __init__(self, name: str, config: dict, temperature: float = 0):
+        local_cf = {
+            "model": "local",
+            "api_key": DEFAULT_LOCAL_KEY,
+            "base_url": DEFAULT_LOCAL_URL,
+        }
+        local_cf.update(config)
+        super().__init__(name, local_cf, temperature)
+
+
+class MockProvider(Provider):
+    """In-process provider which never touches the network. It returns the
+    prompt's mock response built from the example answers in the
+    spreadsheet, so results are deterministic. max_tokens is applied using
+    the same estimate as the scheduler, and if the messages end with a
+    partial answer the mock carries on from where it left off."""
+
+    def chat(
+        self,
+        messages: list[BaseMessage],
+        prompt: CasePrompt = None,
+        max_tokens: int = None,
+    ) -> ChatResponse:
+        if prompt is None:
+            return ChatResponse(content="")
+        sent = "".join(m.content for m in messages if isinstance(m, AIMessage))
+        start = len(sent)
+        content = prompt.mock_response()[start:]
+        tokens = estimate_tokens(content)
+        truncated = False
+        if max_tokens and tokens > max_tokens:
+            content = content[: max_tokens * CHARS_PER_TOKEN]
+            tokens = max_tokens
+            truncated = True
+        usage = {"completion_tokens": tokens, "total_tokens": tokens}
+        return ChatResponse(content=content, usage=usage, truncated=truncated)
+
+
+class FaultyProvider(Provider):
+    """Wraps another provider, given as a config entry in "wraps", and
+    injects faults so that runs can be tested against a degraded backend:
+
+    latency: {"type": "fixed", "seconds": s}, {"type": "uniform", "min": a,
+    "max": b}, {"type": "lognormal", "median": m, "sigma": s} or
+    {"type": "exponential", "mean": m} - added to every request
+    error_rate: fraction of requests which fail with a TransientError
+    rate_limit_rate: fraction of requests which start a burst of burst_length
+    rate limit (429) errors
+    truncate_rate: fraction of responses cut off partway through
+    malformed_rate: fraction of responses which are broken JSON
+    seed: for a repeatable run
+
+    The number of each kind of fault injected is kept in faults."""
+
+    def __init__(self, name: str, config: dict, temperature: float = 0):
+        if "wraps" not in config:
+            raise ProviderException(f"Provider {name} needs a value for 'wraps'")
+        self.inner = make_provider(name, config["wraps"], temperature)
+        super().__init__(name, {"model": self.inner.model, **config}, temperature)
+        self.latency = config.get("latency", {"type": "fixed", "seconds": 0})
+        self.error_rate = config.get("error_rate", 0)
+        self.rate_limit_rate = config.get("rate_limit_rate", 0)
+        self.burst_length = config.get("burst_length", 5)
+        self.truncate_rate = config.get("truncate_rate", 0)
+        self.malformed_rate = config.get("malformed_rate", 0)
+        self.random = random.Random(config.get("seed", None))
+        self.burst = 0
+        self.faults = {"error": 0, "rate_limit": 0, "truncated": 0, "malformed": 0}
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        kind = self.latency.get("type", "fixed")
+        r = self.random
+        if kind == "fixed":
+            return self.latency.get("seconds", 0)
+        if kind == "uniform":
+            return r.uniform(self.latency["min"], self.latency["max"])
+        if kind == "lognormal":
+            return r.lognormvariate(0, self.latency["sigma"]) * self.latency["median"]
+        if kind == "exponential":
+            return r.expovariate(1 / self.latency["mean"])
+        raise ProviderException(f"Unknown latency distribution {kind}")
+
+    def fault(self) -> tuple[float, str]:
+        """Pick the latency and the fault, if any, for a request"""
+        with self.lock:
+            delay = self.delay()
+            fault = None
+            if self.burst > 0:
+                self.burst -= 1
+                fault = "rate_limit"
+            elif self.random.random() < self.rate_limit_rate:
+                self.burst = self.burst_length - 1
+                fault = "rate_limit"
+            elif self.random.random() < self.error_rate:
+                fault = "error"
+            elif self.random.random() < self.truncate_rate:
+                fault = "truncated"
+            elif self.random.random() < self.malformed_rate:
+                fault = "malformed"
+            if fault:
+                self.faults[fault] += 1
+            return delay, fault
+
+    def chat(
+        self,
+        messages: list[BaseMessage],
+        prompt: CasePrompt = None,
+        max_tokens: int = None,
+    ) -> ChatResponse:
+        delay, fault = self.fault()
+        if delay > 0:
+            time.sleep(delay)
+        if fault == "rate_limit":
+            raise TransientError(f"{self.name}: 429 too many requests")
+        if fault == "error":
+            raise TransientError(f"{self.name}: 503 service unavailable")
+        response = self.inner.chat(messages, prompt, max_tokens=max_tokens)
+        if fault == "truncated":
+            cut = len(response.content) // 2
+            response.content = response.content[:cut]
+        if fault == "malformed":
+            response.content = response.content.replace('"', "'", 1) + " I hope this"
+        return response
+
+
+PROVIDER_TYPES = {
+    "openai": OpenAIProvider,
+    "local": LocalProvider,
+    "mock": MockProvider,
+    "faulty": FaultyProvider,
+}
+
+
+def make_provider(name: str, config: dict, temperature: float = 0) -> Provider:
+    """Build a Provider from a config entry. The "type" value selects the
+    class and defaults to "openai"."""
+    ptype = config.get("type", "openai")
+    if ptype not in PROVIDER_TYPES:
+        raise ProviderException(f"Provider {name} has unknown type {ptype}")
+    return PROVIDER_TYPES[ptype](name, config, temperature)
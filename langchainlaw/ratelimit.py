@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces out requests to the LLM so that each one starts at least
+    interval seconds after the one before it. Safe to share between threads."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Book the next free slot and return how many seconds away it is"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + self.interval
+            return start - now
+
+    def try_reserve(self) -> bool:
+        """Book a slot only if one is free right now, for optional requests
+        which shouldn't eat into the rate limit"""
+        with self.lock:
+            now = time.monotonic()
+            if self.next_at > now:
+                return False
+            self.next_at = now + self.interval
+            return True
+
+    def wait(self) -> float:
+        """Block until it's our turn to send a request. Returns the number of
+        seconds spent waiting."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
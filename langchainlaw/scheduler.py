@@ -0,0 +1,213 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from langchainlaw.classifier import Classifier
+from langchainlaw.prompts import CasePrompt, ResultsDict, estimate_tokens
+
+WINDOW = 60
+
+
+@dataclass
+class WorkItem:
+    """One (case, prompt) request with its estimated size and cost"""
+
+    case_id: str
+    casefile: Path
+    prompt: str
+    input_tokens: int
+    output_tokens: int
+    cost: float = 0
+    cached: bool = False
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+def estimate_item(
+    classifier: Classifier,
+    case_id: str,
+    casefile: Path,
+    prompt: CasePrompt,
+    no_cache: bool = False,
+) -> WorkItem:
+    """Estimate the tokens for one prompt on the classifier's current
+    judgment. The output estimate is the length of the example response, times
+    the number of repeats for json_multiple prompts. Prompts which are already
+    in the cache are marked as cached and cost nothing. Looking them up here
+    isn't counted as a cache hit, as the run will count it."""
+    if (
+        classifier.cache
+        and not no_cache
+        and classifier.cache.load(case_id, prompt.name) is not None
+    ):
+        return WorkItem(case_id, casefile, prompt.name, 0, 0, 0, True)
+    input_tokens = estimate_tokens(classifier.system)
+    for message in classifier.make_messages(prompt):
+        input_tokens += estimate_tokens(message.content)
+    output_tokens = prompt.output_tokens
+    cost = classifier.provider_for(prompt).cost(input_tokens, output_tokens)
+    return WorkItem(case_id, casefile, prompt.name, input_tokens, output_tokens, cost)
+
+
+def estimate_work(
+    classifier: Classifier,
+    cases: list[Path],
+    prompts: list[str] = None,
+    no_cache: bool = False,
+) -> list[WorkItem]:
+    """Render the message for every case and prompt and estimate how many
+    tokens it will use"""
+    items = []
+    for casefile in cases:
+        classifier.load_judgment(casefile)
+        for prompt in classifier.next_prompt():
+            if not prompts or prompt.name in prompts:
+                items.append(
+                    estimate_item(classifier, casefile.stem, casefile, prompt, no_cache)
+                )
+    return items
+
+
+class Scheduler:
+    """Puts WorkItems in priority order, cuts them off at a token or dollar
+    budget and packs them into one-minute windows which stay under the
+    provider's tokens-per-minute limit.
+
+    Prompts named in prompt_priority come first, in that order, then cases
+    named in case_priority (by file name or case ID), and otherwise items
+    keep the order they were estimated in."""
+
+    def __init__(
+        self,
+        items: list[WorkItem],
+        max_tokens: int = None,
+        max_cost: float = None,
+        prompt_priority: list[str] = None,
+        case_priority: list[str] = None,
+        tokens_per_minute: int = None,
+        requests_per_minute: int = None,
+    ):
+        self.items = items
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.prompt_priority = prompt_priority or []
+        self.case_priority = case_priority or []
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+
+    def rank(self, item: WorkItem) -> tuple[int, int]:
+        unranked = len(self.prompt_priority) + len(self.case_priority)
+        prompt_rank = unranked
+        if item.prompt in self.prompt_priority:
+            prompt_rank = self.prompt_priority.index(item.prompt)
+        case_rank = unranked
+        for name in (item.casefile.name, item.case_id):
+            if name in self.case_priority:
+                case_rank = self.case_priority.index(name)
+        return prompt_rank, case_rank
+
+    def ordered(self) -> list[WorkItem]:
+        """Items in priority order (sorted is stable so ties keep their
+        original order)"""
+        return sorted(self.items, key=self.rank)
+
+    def budgeted(self) -> list[WorkItem]:
+        """Ordered items, stopping at the first which would go over budget.
+        Cached items are always included as they are free."""
+        selected = []
+        tokens = 0
+        cost = 0
+        over = False
+        for item in self.ordered():
+            if item.cached:
+                selected.append(item)
+                continue
+            if self.max_tokens is not None and tokens + item.tokens > self.max_tokens:
+                over = True
+            if self.max_cost is not None and cost + item.cost > self.max_cost:
+                over = True
+            if over:
+                continue
+            tokens += item.tokens
+            cost += item.cost
+            selected.append(item)
+        return selected
+
+    def windows(self) -> list[list[WorkItem]]:
+        """Packs the budgeted items into one-minute windows, first fit: each
+        item goes into the earliest window with room for it, so that small
+        requests fill the gaps left by big ones without getting far ahead of
+        their priority. An item bigger than the limit gets a window of its
+        own. Cached items go in the first window."""
+        windows = []
+        tokens = []
+        cached = []
+        for item in self.budgeted():
+            if item.cached:
+                cached.append(item)
+                continue
+            for i, window in enumerate(windows):
+                if self.fits(window, tokens[i], item):
+                    window.append(item)
+                    tokens[i] += item.tokens
+                    break
+            else:
+                windows.append([item])
+                tokens.append(item.tokens)
+        if cached:
+            if windows:
+                windows[0] = cached + windows[0]
+            else:
+                windows.append(cached)
+        return windows
+
+    def fits(self, window: list[WorkItem], tokens: int, item: WorkItem) -> bool:
+        if self.requests_per_minute and len(window) >= self.requests_per_minute:
+            return False
+        if self.tokens_per_minute and tokens + item.tokens > self.tokens_per_minute:
+            return False
+        return True
+
+    def summary(self) -> str:
+        budgeted = self.budgeted()
+        tokens = sum(i.tokens for i in budgeted)
+        cost = sum(i.cost for i in budgeted)
+        requests = len([i for i in budgeted if not i.cached])
+        return (
+            f"Scheduled {len(budgeted)} of {len(self.items)} prompts"
+            f" ({requests} requests, ~{tokens} tokens, ~${cost:.2f})"
+            f" in {len(self.windows())} minutes"
+        )
+
+
+def run_schedule(
+    classifier: Classifier, windows: list[list[WorkItem]], no_cache: bool = False
+) -> dict[str, ResultsDict]:
+    """Run the work in each window, waiting for the start of the next minute
+    before going on to the next window. Returns the results by case ID."""
+    results = {}
+    casefile = None
+    for window in windows:
+        started = time.monotonic()
+        for item in window:
+            if item.casefile != casefile:
+                classifier.load_judgment(item.casefile)
+                casefile = item.casefile
+            if item.case_id not in results:
+                results[item.case_id] = {
+                    "file": str(item.casefile),
+                    "mnc": classifier.judgment["mnc"],
+                }
+            prompt = classifier.prompt(item.prompt)
+            results[item.case_id][item.prompt] = classifier.run_prompt(
+                item.case_id, prompt, no_cache=no_cache
+            )
+            classifier.add_agreement(results[item.case_id], item.case_id, prompt)
+        if window is not windows[-1]:
+            remaining = started + WINDOW - time.monotonic()
+            if remaining > 0:
+                classifier.log(f"waiting {remaining:.1f} for the next window")
+                time.sleep(remaining)
+    return results
@@ -0,0 +1,126 @@
+import json
+import time
+from pathlib import Path
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.fs
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from langchainlaw.classifier import AGREEMENT
+
+BATCH_SIZE = 1000
+PART = "part-{:05d}.parquet"
+
+
+class StoreException(Exception):
+    pass
+
+
+def check_pyarrow():
+    if pyarrow is None:
+        raise StoreException("The results store needs pyarrow installed")
+
+
+def results_schema(headers: list[str]):
+    """An Arrow schema for the classifier's headers: agreement columns are
+    floats and everything else is a string"""
+    check_pyarrow()
+    return pyarrow.schema(
+        [
+            (h, pyarrow.float64() if h.endswith(":" + AGREEMENT) else pyarrow.string())
+            for h in headers
+        ]
+    )
+
+
+def as_text(value) -> str:
+    """Results can be any JSON value: anything which isn't a string already is
+    stored as JSON"""
+    if value is None or type(value) is str:
+        return value
+    return json.dumps(value)
+
+
+def as_float(value) -> float:
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+class ResultsStore:
+    """Append-only Parquet store for flattened classifier results. Each run
+    writes its own partition, root/run=RUN_ID/, as a series of part files of
+    up to batch_size cases, so that a crash only loses the current batch and
+    earlier runs are never rewritten."""
+
+    def __init__(
+        self,
+        root: str,
+        headers: list[str],
+        run: str = None,
+        batch_size: int = BATCH_SIZE,
+    ):
+        self.schema = results_schema(headers)
+        self.run = run or time.strftime("%Y%m%dT%H%M%S")
+        self.dir = Path(root) / f"run={self.run}"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.rows = []
+        self.parts = len(list(self.dir.glob("part-*.parquet")))
+
+    def append(self, row: dict):
+        """Add one case's results, as a dict by header"""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new part file"""
+        if not self.rows:
+            return
+        columns = {}
+        for field in self.schema:
+            convert = as_float if pyarrow.types.is_floating(field.type) else as_text
+            columns[field.name] = [convert(row.get(field.name)) for row in self.rows]
+        table = pyarrow.table(columns, schema=self.schema)
+        pyarrow.parquet.write_table(table, self.dir / PART.format(self.parts))
+        self.parts += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_results(root: str, columns: list[str] = None, runs: list[str] = None):
+    """Reads the results store as an Arrow table, with a 'run' column. Only
+    the named columns are read, and the files are memory-mapped. Runs with
+    different prompts are merged, with nulls for the columns a run doesn't
+    have. Use .to_pandas() on the result for a dataframe."""
+    check_pyarrow()
+    filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+    files = sorted(str(p) for p in Path(root).glob("run=*/part-*.parquet"))
+    if runs is not None:
+        files = [f for f in files if Path(f).parent.name[4:] in runs]
+    if not files:
+        raise StoreException(f"No results found in {root}")
+    schemas = [pyarrow.parquet.read_schema(f, memory_map=True) for f in files]
+    schema = pyarrow.unify_schemas(schemas + [pyarrow.schema([("run", "string")])])
+    dataset = pyarrow.dataset.dataset(
+        files,
+        schema=schema,
+        format="parquet",
+        filesystem=filesystem,
+        partitioning=pyarrow.dataset.partitioning(flavor="hive"),
+        partition_base_dir=str(Path(root)),
+    )
+    return dataset.to_table(columns=columns)
@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from openpyxl import Workbook
+
+from langchainlaw.classifier import Classifier
+from langchainlaw.ratelimit import RateLimiter
+
+DEFAULT_QUEUE = "queue.sqlite"
+LEASE = 3600
+MAX_ATTEMPTS = 3
+POLL = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    case_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    casefile TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (case_id, prompt)
+);
+CREATE TABLE IF NOT EXISTS budget (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    next_at REAL NOT NULL
+);
+INSERT OR IGNORE INTO budget (id, next_at) VALUES (0, 0);
+"""
+
+
+@dataclass
+class Job:
+    case_id: str
+    prompt: str
+    casefile: str
+    attempts: int = 0
+    worker: str = None
+
+
+class WorkQueue:
+    """A queue of (case, prompt) jobs in an SQLite database which can be
+    shared by workers on several machines. Workers take a lease on each job
+    they claim: if a worker dies, its jobs are handed out again once the lease
+    runs out. The database also holds the shared rate limit budget.
+
+    A worker's sampling and hedging threads book rate limit slots through the
+    same queue, so the connection is shared between threads under a lock."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self.lock = threading.RLock()
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def transaction(self):
+        """BEGIN IMMEDIATE takes the write lock straight away, so two workers
+        can't claim the same job"""
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def enqueue(self, jobs: list[Job]) -> int:
+        """Add jobs to the queue, skipping any which are already in it.
+        Returns the number of new jobs."""
+        with self.lock:
+            self.transaction()
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO jobs (case_id, prompt, casefile)"
+                " VALUES (?, ?, ?)",
+                [(j.case_id, j.prompt, j.casefile) for j in jobs],
+            )
+            self.db.execute("COMMIT")
+            return self.db.total_changes - before
+
+    def claim(
+        self, worker: str, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS
+    ) -> Job | None:
+        """Lease the next available job to a worker, or return None if there
+        are no jobs available right now. A job whose lease ran out on its last
+        attempt is marked as failed, so that a job which keeps killing its
+        worker isn't handed out forever."""
+        with self.lock:
+            now = time.time()
+            self.transaction()
+            self.db.execute(
+                "UPDATE jobs SET status = 'failed', lease_until = NULL,"
+                " error = 'lease expired on attempt ' || attempts"
+                " WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, max_attempts),
+            )
+            row = self.db.execute(
+                "SELECT rowid, case_id, prompt, casefile, attempts FROM jobs"
+                " WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?)"
+                " ORDER BY rowid LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            rowid, case_id, prompt, casefile, attempts = row
+            self.db.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?,"
+                " attempts = attempts + 1 WHERE rowid = ?",
+                (worker, now + lease, rowid),
+            )
+            self.db.execute("COMMIT")
+            return Job(case_id, prompt, casefile, attempts + 1, worker)
+
+    def complete(self, job: Job) -> bool:
+        """Mark a job as done. Returns False if the worker no longer holds
+        the job, because its lease ran out and another worker claimed it."""
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL"
+                " WHERE case_id = ? AND prompt = ? AND worker = ?"
+                " AND status = 'leased'",
+                (job.case_id, job.prompt, job.worker),
+            )
+            return cursor.rowcount > 0
+
+    def fail(self, job: Job, error: str, max_attempts: int = MAX_ATTEMPTS) -> bool:
+        """Put a job back in the queue, or mark it as failed if it has run out
+        of attempts. Returns False if the worker no longer holds the job."""
+        with self.lock:
+            status = "failed" if job.attempts >= max_attempts else "pending"
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, error = ?"
+                " WHERE case_id = ? AND prompt = ? AND worker = ?"
+                " AND status = 'leased'",
+                (status, error, job.case_id, job.prompt, job.worker),
+            )
+            return cursor.rowcount > 0
+
+    def counts(self) -> dict[str, int]:
+        """Returns the number of jobs by status"""
+        with self.lock:
+            rows = self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            return dict(rows.fetchall())
+
+    def casefiles(self) -> list[str]:
+        """Returns the distinct case files in the queue, in the order they
+        were added"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT casefile FROM jobs GROUP BY casefile ORDER BY MIN(rowid)"
+            )
+            return [r[0] for r in rows.fetchall()]
+
+    def reserve_slot(self, interval: float, now_only: bool = False) -> float:
+        """Book the next slot in the shared rate limit and return how many
+        seconds away it is. With now_only, the slot is only booked if it's
+        free now, and None is returned if it isn't."""
+        with self.lock:
+            now = time.time()
+            self.transaction()
+            (next_at,) = self.db.execute("SELECT next_at FROM budget").fetchone()
+            if now_only and next_at > now:
+                self.db.execute("COMMIT")
+                return None
+            start = max(now, next_at)
+            self.db.execute("UPDATE budget SET next_at = ?", (start + interval,))
+            self.db.execute("COMMIT")
+            return start - now
+
+
+class SharedRateLimiter(RateLimiter):
+    """A RateLimiter whose slots are booked in the work queue, so that all the
+    workers together stay within one rate limit"""
+
+    def __init__(self, queue: WorkQueue, interval: float):
+        super().__init__(interval)
+        self.queue = queue
+
+    def reserve(self) -> float:
+        return self.queue.reserve_slot(self.interval)
+
+    def try_reserve(self) -> bool:
+        return self.queue.reserve_slot(self.interval, now_only=True) is not None
+
+
+def make_jobs(classifier: Classifier, cases: list[Path], prompts: list[str]):
+    """Returns a Job for every combination of case file and prompt"""
+    return [
+        Job(casefile.stem, name, str(casefile))
+        for casefile in cases
+        for name in classifier.prompt_names
+        if not prompts or name in prompts
+    ]
+
+
+def work(
+    classifier: Classifier,
+    queue: WorkQueue,
+    worker: str,
+    lease: float = LEASE,
+    max_attempts: int = MAX_ATTEMPTS,
+    no_cache: bool = False,
+):
+    """Keep claiming and running jobs until the queue is finished. Responses
+    go into the classifier's cache, which should be on storage shared by all
+    of the workers."""
+    classifier.rate_limiter = SharedRateLimiter(queue, classifier.rate_limit)
+    casefile = None
+    while True:
+        job = queue.claim(worker, lease, max_attempts)
+        if job is None:
+            if queue.counts().get("leased", 0) == 0:
+                return
+            # other workers' leases might expire, so wait and try again
+            time.sleep(POLL)
+            continue
+        try:
+            if job.casefile != casefile:
+                classifier.load_judgment(Path(job.casefile))
+                casefile = job.casefile
+            prompt = classifier.prompt(job.prompt)
+            classifier.get_response(job.case_id, prompt, no_cache=no_cache)
+            if not queue.complete(job):
+                classifier.log(f"[{job.case_id}] {job.prompt} - lease lost")
+        except Exception as e:
+            classifier.log(f"[{job.case_id}] {job.prompt} - failed: {e}")
+            if not queue.fail(job, str(e), max_attempts):
+                classifier.log(f"[{job.case_id}] {job.prompt} - lease lost")
+        finally:
+            # the samples are in the cache, and agreement is only added to
+            # results by classify, so don't keep them for the life of the worker
+            classifier.sampled.pop((job.case_id, job.prompt), None)
+
+
+def assemble(classifier: Classifier, queue: WorkQueue, spreadsheet: str):
+    """Build the results spreadsheet from the cache for every case in the
+    queue. Anything which isn't in the cache is reported as an error."""
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append(classifier.headers)
+    for casefile in queue.casefiles():
+        results = classifier.classify(Path(casefile), cache_only=True)
+        worksheet.append(classifier.as_columns(results))
+    print(f"Writing results to {spreadsheet}")
+    workbook.save(spreadsheet)
+
+
+def cli():
+    ap = argparse.ArgumentParser("classify-queue")
+    ap.add_argument(
+        "--config",
+        default="./config.json",
+        type=Path,
+        help="Config file",
+    )
+    ap.add_argument(
+        "--queue",
+        default=None,
+        type=str,
+        help="Queue database (overrides the config)",
+    )
+    sub = ap.add_subparsers(dest="command", required=True)
+    enqueue_ap = sub.add_parser("enqueue", help="Add (case, prompt) jobs to the queue")
+    enqueue_ap.add_argument("--case", default="", type=str, help="A single case")
+    enqueue_ap.add_argument("--prompt", default="", type=str, help="A single prompt")
+    work_ap = sub.add_parser("work", help="Run jobs until the queue is finished")
+    work_ap.add_argument(
+        "--lease", default=LEASE, type=float, help="Seconds before a job is retried"
+    )
+    work_ap.add_argument(
+        "--max-attempts", default=MAX_ATTEMPTS, type=int, help="Tries per job"
+    )
+    work_ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Ignore cached results, always call the LLM",
+    )
+    sub.add_parser("assemble", help="Write the results spreadsheet from the cache")
+    sub.add_parser("status", help="Show the number of jobs by status")
+
+    args = ap.parse_args()
+
+    with open(args.config, "r") as cfh:
+        config = json.load(cfh)
+
+    queue = WorkQueue(args.queue or config.get("queue", DEFAULT_QUEUE))
+
+    if args.command == "status":
+        for status, n in sorted(queue.counts().items()):
+            print(f"{status}: {n}")
+        return
+
+    classifier = Classifier(config)
+    classifier.load_prompts(config["prompts"])
+
+    if args.command == "enqueue":
+        prompts = None
+        if args.prompt:
+            if args.prompt not in classifier.prompts:
+                print(f"No prompt defined with name '{args.prompt}'")
+                return
+            prompts = [args.prompt]
+        if args.case:
+            cases = [Path(config["input"]) / Path(args.case)]
+        else:
+            cases = sorted(Path(config["input"]).glob("*.json"))
+        added = queue.enqueue(make_jobs(classifier, cases, prompts))
+        print(f"Added {added} jobs to {queue.path}")
+    elif args.command == "work":
+        if classifier.cache is None:
+            print("Workers need a shared cache directory in the config")
+            return
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        work(classifier, queue, worker, args.lease, args.max_attempts, args.no_cache)
+        classifier.cache.flush()
+    elif args.command == "assemble":
+        assemble(classifier, queue, config.get("output", "results.xlsx"))
+        if classifier.cache:
+            classifier.cache.flush()
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,5 +1,8 @@
+import json
 import pytest
 
+from langchainlaw.classifier import Classifier
+
 NESTED_RESULTS = {
     "file": "tests/input/123456789abcdef0.json",
     "mnc": "This is a dummy case to feed to the classifier for tests",
@@ -109,6 +112,26 @@ def files():
     }
 
 
+@pytest.fixture
+def mock_config(files, tmp_path):
+    """The test config with the mock LLM, no rate limit and a temporary cache.
+    Override this in a test module to change the config for mock_classifier."""
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    cf["providers"]["mock"] = {"type": "mock"}
+    cf["provider"] = "mock"
+    cf["rate_limit"] = 0
+    cf["cache"] = str(tmp_path / "cache")
+    return cf
+
+
+@pytest.fixture
+def mock_classifier(files, mock_config):
+    classifier = Classifier(mock_config, quiet=True)
+    classifier.load_prompts(files["prompts"])
+    return classifier
+
+
 @pytest.fixture
 def variants_of_json():
     return [
@@ -1,5 +1,9 @@
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from langchainlaw.cache import Cache
+from langchainlaw.cachetool import select_garbage
 
 
 def test_cache(tmp_path):
@@ -9,3 +13,96 @@ def test_cache(tmp_path):
     cache.write("testA", "testB", "contents")
     contents = cache.read("testA", "testB")
     assert contents == "contents"
+
+
+def test_concurrent_writes(tmp_path):
+    """Workers writing different prompts of one case don't lose metadata"""
+    cache_dir = Path(tmp_path) / "cache"
+
+    def write(i):
+        cache = Cache(cache_dir)
+        cache.write("case", f"p{i}", "{}")
+        cache.read("case", f"p{i}")
+        cache.flush()
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        list(executor.map(write, range(50)))
+    cache = Cache(cache_dir)
+    assert len(cache.metadata("case")) == 50
+    assert cache.stats()["hits"] == 50
+    for i in range(50):
+        cache.delete("case", f"p{i}")
+    assert not cache.exists("case")
+
+
+def test_compressed_cache(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    cache_dir = Path(tmp_path) / "cache"
+    plain = Cache(cache_dir)
+    for i in range(200):
+        response = json.dumps(
+            {"filing_date": f"2010-06-{i % 28 + 1:02}", "interlocutory": "no (p1)"}
+        )
+        plain.write(f"case{i}", "dates", response)
+    plain.write("case0", "parties", "just one")
+    before = plain.size()
+    compacted = plain.compact()
+    assert compacted == {"dates": 200, "parties": 1}
+    assert plain.size() < before
+    assert not (cache_dir / "case0" / "dates").exists()
+    assert (cache_dir / "case0" / "dates.zst").exists()
+    assert list(plain.entries("case0")) == ["dates", "parties"]
+    assert ".dicts" not in set(plain.case_ids())
+
+    # a fresh cache reads compressed entries transparently
+    reader = Cache(cache_dir)
+    assert json.loads(reader.read("case3", "dates"))["filing_date"] == "2010-06-04"
+    assert reader.read("case0", "parties") == "just one"
+    dictionary = reader.dictionary("dates")
+    data = (cache_dir / "case3" / "dates.zst").read_bytes()
+    assert zstandard.get_frame_parameters(data).dict_id == dictionary.dict_id()
+
+    # new entries are compressed with the trained dictionary
+    writer = Cache(cache_dir, compress=True)
+    writer.write("case999", "dates", '{"filing_date": "2011-01-01"}')
+    assert reader.read("case999", "dates") == '{"filing_date": "2011-01-01"}'
+    writer.write("case0", "parties", "uncompressed")
+    Cache(cache_dir).write("case0", "parties", "uncompressed")
+    assert not (cache_dir / "case0" / "parties.zst").exists()
+
+
+def test_metadata_and_gc(tmp_path):
+    cache = Cache(Path(tmp_path) / "cache")
+    cache.write("a", "dates", '{"filing_date": "2010"}', model="m", prompt_hash="h")
+    cache.write("a", "wills", "This model's maximum context length is 8192")
+    cache.write("b", "dates", "not json")
+    cache.write("b", "removed", '{"x": "y"}')
+    [dates, wills] = cache.entry_info("a")
+    assert dates.model == "m" and dates.prompt_hash == "h"
+    assert dates.size == len('{"filing_date": "2010"}')
+
+    assert cache.read("a", "dates") is not None
+    assert cache.read("a", "nonexistent") is None
+    cache.flush()
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+    return_types = {"dates": "json", "wills": "json"}
+    garbage = select_garbage(cache, prompts=["dates", "wills"])
+    assert [(e.case_id, e.filename) for e in garbage] == [("b", "removed")]
+    garbage = select_garbage(cache, errors=True, return_types=return_types)
+    assert sorted((e.case_id, e.filename) for e in garbage) == [
+        ("a", "wills"),
+        ("b", "dates"),
+    ]
+    assert select_garbage(cache, ttl=-1) != []
+    assert select_garbage(cache, ttl=3600) == []
+
+    # a/dates was the last one read so it's the last to be evicted
+    garbage = select_garbage(cache, max_size=dates.size)
+    assert ("a", "dates") not in [(e.case_id, e.filename) for e in garbage]
+    assert len(garbage) == 3
+
+    for entry in select_garbage(cache, prompts=["wills"]):
+        cache.delete(entry.case_id, entry.filename)
+    assert list(cache.case_ids()) == ["a"]
+    assert cache.entries("a") == ["wills"]
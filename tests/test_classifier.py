@@ -24,3 +24,39 @@ def test_parse_results(files, headers, results, flat_results):
     assert got_results == results
     got_flat = classifier.as_dict(results)
     assert got_flat == flat_results
+
+
+def test_classify_many(files, mock_classifier, tmp_path):
+    classifier = mock_classifier
+    case = Path(files["case"])
+    with open(case, "r") as fh:
+        judgment = json.load(fh)
+    expected = classifier.classify(case)
+    pulled = []
+    finished = []
+
+    def judgments():
+        for i in range(10):
+            # never more than concurrency judgments in flight
+            assert len(pulled) - len(finished) <= 2
+            pulled.append(i)
+            yield {**judgment, "uri": f"/decision/case{i}"}
+
+    for case_id, results in classifier.classify_many(judgments(), concurrency=2):
+        finished.append(case_id)
+        assert results["file"] == case_id
+        assert results["dates"] == expected["dates"]
+    assert sorted(finished) == sorted(f"case{i}" for i in range(10))
+    assert (tmp_path / "cache" / "case9").is_dir()
+    mixed = [("db1", judgment), case]
+    ids = dict(classifier.classify_many(mixed, prompts=["dates"]))
+    assert set(ids) == {"db1", case.stem}
+    assert ids[case.stem]["file"] == str(case)
+    # the casefile was loaded from the judgment cache
+    assert classifier.judgments.hits > 0
+    # a case which fails doesn't stop the others
+    broken = [("bad", {"judgment": "no mnc"}), ("db1", judgment)]
+    ids = dict(classifier.classify_many(broken, prompts=["dates"]))
+    assert set(ids) == {"bad", "db1"}
+    assert "mnc" in ids["bad"]["dates"][0]
+    assert classifier.as_columns(ids["bad"])[:2] == ["bad", ""]
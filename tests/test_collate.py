@@ -0,0 +1,119 @@
+import json
+import pytest
+from openpyxl import Workbook
+from langchainlaw import collate
+from langchainlaw.cache import Cache
+from langchainlaw.preprocess import preprocess_casefiles
+from langchainlaw.collate import (
+    collate_layout,
+    collate_rows,
+    expand_ra_cols,
+    find_cached_results,
+    load_ra_index,
+    load_ra_spreadsheet,
+    load_collate_state,
+    ra_index_file,
+    save_collate_state,
+)
+
+URI = "https://www.caselaw.nsw.gov.au/decision/"
+
+
+@pytest.fixture
+def ra_config(tmp_path):
+    cf = {
+        "SPREADSHEET_IN": str(tmp_path / "ra.xlsx"),
+        "SPREADSHEET_IN_COLS": ["mnc", "RA", "uri", "CLAIMANT", "DEFENDANT"],
+        "PARTIES_IN_COLS": ["relationship_to_deceased"],
+        "PARTIES_N": 2,
+    }
+    wb = Workbook()
+    ws = wb.active
+    ws.append(expand_ra_cols(cf))
+    ws.append(["[2010] NSWSC 1", "RA1", URI + "aaa1", "son", "", "wife", ""])
+    ws.append([None, "RA2", URI + "aaa1", "son", "daughter", "wife", ""])
+    ws.append(["[2010] NSWSC 2", "RA1", "not a uri", "", "", "", ""])
+    ws.append(["[2010] NSWSC 3", "RA1", URI + "bbb2", "wife", "", "", ""])
+    ws.append(["[2010] NSWSC 4", "RA2", URI + "ccc3"])
+    wb.save(cf["SPREADSHEET_IN"])
+    return cf
+
+
+def test_load_ra_spreadsheet(ra_config):
+    cols, cases = load_ra_spreadsheet(ra_config)
+    assert cols[3] == "claimant_1_relationship_to_deceased"
+    assert list(cases) == ["aaa1", "bbb2", "ccc3"]
+    assert len(cases["aaa1"]) == 2
+    # merged mnc is copied from the first row
+    assert cases["aaa1"][1]["mnc"] == "[2010] NSWSC 1"
+    assert cases["aaa1"][1]["claimant_2_relationship_to_deceased"] == "daughter"
+    assert cases["ccc3"][0]["defendant_1_relationship_to_deceased"] is None
+
+
+def test_ra_index(ra_config):
+    index = load_ra_index(ra_config)
+    assert index == {"aaa1": [2, 3], "bbb2": [5], "ccc3": [6]}
+    assert ra_index_file(ra_config).is_file()
+    assert load_ra_index(ra_config) == index
+
+
+def test_load_selected_cases(ra_config):
+    _, cases = load_ra_spreadsheet(ra_config, ["bbb2", "aaa1"])
+    assert set(cases) == {"aaa1", "bbb2"}
+    assert len(cases["aaa1"]) == 2
+    _, cases = load_ra_spreadsheet(ra_config, ["nonexistent"])
+    assert cases == {}
+
+
+def test_incremental_collate(ra_config, tmp_path, monkeypatch):
+    ra_config["SPREADSHEET_IN_COLS"] += [f"col{i}" for i in range(8)] + ["filing_date"]
+    mappings = {"filing_date": "filing_date"}
+    cache = Cache(tmp_path / "cache")
+    cache.write("aaa1", "filing_date", "2010-06-05")
+    cache.write("bbb2", "filing_date", "2011-01-01")
+    cols, ra_cases = load_ra_spreadsheet(ra_config)
+
+    reads = []
+
+    def counting_find(cache, case_id, mapping):
+        reads.append(case_id)
+        return find_cached_results(cache, case_id, mapping)
+
+    monkeypatch.setattr(collate, "find_cached_results", counting_find)
+    state = {}
+    rows = list(collate_rows(cols, mappings, cache, ra_cases, state, True))
+    assert reads == ["aaa1", "bbb2", "ccc3"]
+    assert rows[3][-1] == "2010-06-05"
+    assert rows[-1] == ["[2010] NSWSC 4", "GPT-4o", "No results"]
+    # collating doesn't count as using the cache
+    assert cache.hits == 0 and cache.misses == 0 and not cache.accessed
+
+    state = json.loads(json.dumps(state))  # as if saved and loaded
+    reads.clear()
+    cache.write("bbb2", "filing_date", "2011-01-02 (p7)")
+    again = list(collate_rows(cols, mappings, cache, ra_cases, state, True))
+    assert reads == ["bbb2"]
+    assert again[3] == rows[3]
+    assert again[5][-1] == "2011-01-02 (p7)"
+
+
+def test_collate_state_layout(tmp_path):
+    state_file = tmp_path / "state.json"
+    layout = collate_layout(["mnc", "filing_date"], {"dates": "filing_date"})
+    save_collate_state(state_file, {"aaa1": {"llm_cols": []}}, layout)
+    assert load_collate_state(state_file, layout) == {"aaa1": {"llm_cols": []}}
+    changed = collate_layout(["mnc", "filing_date"], {"dates": "date_filed"})
+    assert load_collate_state(state_file, changed) == {}
+
+
+def test_collate_preprocessed_only(ra_config, tmp_path):
+    """A case which has been preprocessed but not classified has no results"""
+    mappings = {"filing_date": "filing_date", "parties": "parties"}
+    cache = Cache(tmp_path / "cache")
+    casefile = tmp_path / "aaa1.json"
+    casefile.write_text(json.dumps({"mnc": "[2010] NSWSC 1", "judgment": "1 Text"}))
+    preprocess_casefiles(cache, [casefile])
+    assert find_cached_results(cache, "aaa1", mappings) is None
+    cols, ra_cases = load_ra_spreadsheet(ra_config, ["aaa1"])
+    rows = list(collate_rows(cols, mappings, cache, ra_cases, {}))
+    assert rows[-1] == ["[2010] NSWSC 1", "GPT-4o", "No results"]
@@ -0,0 +1,24 @@
+import csv
+import json
+from pathlib import Path
+from langchainlaw.dryrun import dry_run, size_report
+
+
+def test_dry_run(files, tmp_path):
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    cf["dry_run"] = str(tmp_path / "dry_run")
+    cf["cache"] = str(tmp_path / "cache")
+    cf["rate_limit"] = 15
+    case = Path(files["case"])
+    items = dry_run(cf, [case], workers=2)
+    assert len(items) == 7
+    rendered = (tmp_path / "dry_run" / f"{case.stem}.txt").read_text()
+    assert rendered.startswith("Prompt: dates\n\nBased on the metadata")
+    with open(tmp_path / "dry_run" / "report.csv", "r") as fh:
+        rows = list(csv.DictReader(fh))
+    assert [r["prompt"] for r in rows] == [i.prompt for i in items]
+    assert all(int(r["chars"]) > 0 for r in rows)
+    report = size_report(items, cf["rate_limit"], None)
+    assert "Requests: 7" in report
+    assert "Projected time: 2 minutes" in report
@@ -0,0 +1,90 @@
+import datetime
+import json
+import pytest
+from openpyxl import Workbook
+from langchainlaw.cache import Cache
+from langchainlaw.collate import expand_ra_cols
+from langchainlaw.evaluate import align, by_prompt, normalise, parse_dates, score
+import pandas as pd
+
+URI = "https://www.caselaw.nsw.gov.au/decision/"
+
+
+@pytest.fixture
+def eval_config(tmp_path):
+    cf = {
+        "CACHE": str(tmp_path / "cache"),
+        "SPREADSHEET_IN": str(tmp_path / "ra.xlsx"),
+        "SPREADSHEET_IN_COLS": [
+            "mnc",
+            "RA",
+            "uri",
+            "filing_date",
+            "death_date",
+            "will_date",
+            "CLAIMANT",
+            "DEFENDANT",
+        ],
+        "PARTIES_IN_COLS": ["relationship_to_deceased"],
+        "PARTIES_N": 2,
+        "SPREADSHEET_OUT_COLS": {
+            "filing_date": "filing_date",
+            "death_date": "death_date",
+            "will_date": {"document": None, "date": "will_date"},
+            "parties": {
+                "name": None,
+                "role_in_trial": None,
+                "relationship_to_party": "relationship_to_deceased",
+            },
+        },
+    }
+    wb = Workbook()
+    ws = wb.active
+    ws.append(expand_ra_cols(cf))
+    filed = datetime.datetime(2010, 6, 5)
+    ws.append(["mnc1", "RA1", URI + "aaa1", filed, "2/5/2008", "5/6/1998", "Son"])
+    ws.cell(row=2, column=9).value = "wife"
+    ws.append(["mnc2", "RA1", URI + "bbb2", filed, "", "", "daughter"])
+    wb.save(cf["SPREADSHEET_IN"])
+    cache = Cache(cf["CACHE"])
+    cache.write("aaa1", "filing_date", "5/6/2010 (p3)")
+    cache.write("aaa1", "death_date", "2008-05-02")
+    cache.write("aaa1", "will_date", '[{"document": "will", "date": "1998-06-05"}]')
+    parties = [
+        {"name": "J", "role_in_trial": "Plaintiff", "relationship_to_deceased": "son"},
+        {"name": "W", "role_in_trial": "Defendant", "relationship_to_deceased": "wife"},
+    ]
+    cache.write("aaa1", "parties", json.dumps(parties))
+    # bbb2 was only partly classified, so it has no parties
+    cache.write("bbb2", "filing_date", "2010-06-05")
+    return cf
+
+
+def test_normalise():
+    s = pd.Series(["Yes (p7)", "  NOT STATED ", None, "Family Provision Act, 1982"])
+    assert list(normalise(s)) == ["yes", "", "", "family provision act 1982"]
+
+
+def test_parse_dates():
+    s = pd.Series(["5/6/2010", "2010-06-05 (p4)", datetime.datetime(2010, 6, 5), "?"])
+    dates = parse_dates(s)
+    assert (dates[:3] == pd.Timestamp(2010, 6, 5)).all()
+    assert pd.isna(dates[3])
+
+
+def test_score(eval_config):
+    ra, llm, fields = align(eval_config)
+    assert list(ra.index) == ["aaa1"]  # bbb2's LLM results are incomplete
+    assert fields["will_date"] == ("will_date", "date")
+    assert llm.loc["aaa1", "will_date"] == "1998-06-05"
+    scores = score(ra, llm, fields).set_index("field")
+    assert scores.loc["filing_date", "exact"] == 0
+    assert scores.loc["filing_date", "date"] == 1
+    assert scores.loc["death_date", "date"] == 1
+    assert scores.loc["will_date", "date"] == 1
+    assert scores.loc["claimant_1_relationship_to_deceased", "exact"] == 0
+    assert scores.loc["claimant_1_relationship_to_deceased", "normalised"] == 1
+    assert scores.loc["defendant_1_relationship_to_deceased", "exact"] == 1
+    assert scores.loc["claimant_count", "exact"] == 1
+    prompts = by_prompt(scores.reset_index())
+    assert prompts.loc["parties", "normalised"] == 1
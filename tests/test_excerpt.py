@@ -0,0 +1,52 @@
+import json
+from langchainlaw.classifier import Classifier
+from langchainlaw.excerpt import BM25, JudgmentIndex, split_paragraphs, tokenise
+
+JUDGMENT = """1 The plaintiff is the daughter of the deceased.
+
+2 The summons was filed on 3 March 2020, within the limitation period.
+3 The deceased made a will dated 1 June 2015 leaving the estate to her son.
+4 The estate consists of a house in Parramatta and some shares.
+5 Costs were ordered to be paid out of the estate.
+"""
+
+
+def test_split_paragraphs():
+    paras = split_paragraphs(JUDGMENT)
+    assert len(paras) == 5
+    assert paras[0].startswith("1 The plaintiff")
+
+
+def test_bm25():
+    docs = [tokenise(p) for p in split_paragraphs(JUDGMENT)]
+    scores = BM25(docs).scores(tokenise("When was the will made?"))
+    assert scores.index(max(scores)) == 2
+    assert scores[0] == 0
+
+
+def test_index():
+    index = JudgmentIndex(JUDGMENT)
+    top = index.top("What was the filing date of the summons? Was a will made?", 2)
+    assert top == [index.paragraphs[1], index.paragraphs[2]]
+    assert index.top("anything", 10) == index.paragraphs
+
+
+def test_excerpt_prompt(files):
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    classifier = Classifier(cf, quiet=True)
+    classifier.load_prompts(files["prompts"])
+    classifier.judgment = {"mnc": "[2020] NSWSC 1", "judgment": JUDGMENT}
+    prompt = classifier.prompt("dates")
+    full = classifier.make_message(prompt).content
+    assert "Parramatta" in full
+    fingerprint = prompt.fingerprint
+    prompt.excerpt = 2
+    assert prompt.fingerprint != fingerprint
+    excerpted = classifier.make_message(prompt).content
+    assert "3 March 2020" in excerpted
+    assert "Parramatta" not in excerpted
+    assert "[2020] NSWSC 1" in excerpted
+    index = classifier.index
+    classifier.make_message(prompt)
+    assert classifier.index is index
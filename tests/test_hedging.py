@@ -0,0 +1,102 @@
+import pytest
+import threading
+import time
+from concurrent.futures import Future
+
+from langchainlaw.hedging import (
+    DeadlineExceeded,
+    LatencyTracker,
+    first_valid,
+    run_in_thread,
+)
+from langchainlaw.providers import MockProvider
+
+
+class SlowProvider(MockProvider):
+    """Mock which takes delays[n] seconds over its nth request"""
+
+    def __init__(self, delays):
+        super().__init__("slow", {})
+        self.delays = delays
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def chat(self, messages, prompt=None, **kwargs):
+        with self.lock:
+            delay = self.delays[min(self.calls, len(self.delays) - 1)]
+            self.calls += 1
+        time.sleep(delay)
+        return super().chat(messages, prompt, **kwargs)
+
+
+@pytest.fixture
+def mock_config(mock_config):
+    mock_config["retries"] = 0
+    return mock_config
+
+
+@pytest.fixture
+def hedge_classifier(mock_classifier):
+    classifier = mock_classifier
+    classifier.judgment = {"mnc": "[2020] NSWSC 1"}
+    return classifier
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(min_samples=10)
+    for i in range(9):
+        tracker.add("dates", i / 100)
+    assert tracker.threshold("dates") is None
+    for i in range(9, 100):
+        tracker.add("dates", i / 100)
+    assert tracker.threshold("dates") == 0.94
+    assert tracker.threshold("wills") is None
+
+
+def test_first_valid():
+    bad = run_in_thread(lambda: "not json")
+    slow = run_in_thread(lambda: time.sleep(0.05) or "{}")
+    future, result = first_valid([bad, slow], lambda r: r == "{}")
+    assert future is slow and result == "{}"
+    future, result = first_valid([bad], lambda r: r == "{}")
+    assert result == "not json"
+    with pytest.raises(DeadlineExceeded):
+        first_valid([Future()], lambda r: True, timeout=0.01)
+
+
+def test_hedge(hedge_classifier):
+    classifier = hedge_classifier
+    classifier.hedge = True
+    classifier.llm = SlowProvider([2.0, 0])
+    prompt = classifier.prompt("dates")
+    for _ in range(20):
+        classifier.latency.add("dates", 0.01)
+    started = time.monotonic()
+    response = classifier.get_response("x", prompt, no_cache=True)
+    assert time.monotonic() - started < 1.0
+    assert response == prompt.mock_response()
+    assert classifier.stats["hedged"] == 1
+    assert classifier.stats["hedge_won"] == 1
+
+
+def test_no_hedge_over_rate_limit(hedge_classifier):
+    classifier = hedge_classifier
+    classifier.hedge = True
+    classifier.rate_limiter.interval = 60
+    classifier.llm = SlowProvider([0.1])
+    for _ in range(20):
+        classifier.latency.add("dates", 0.01)
+    classifier.get_response("x", classifier.prompt("dates"), no_cache=True)
+    assert classifier.stats["hedge_skipped"] == 1
+    assert classifier.llm.calls == 1
+
+
+def test_deadline(hedge_classifier):
+    classifier = hedge_classifier
+    classifier.deadline = 0.1
+    classifier.llm = SlowProvider([2.0])
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        classifier.get_response("x", classifier.prompt("dates"), no_cache=True)
+    assert time.monotonic() - started < 1.0
+    assert classifier.stats["deadline_exceeded"] == 1
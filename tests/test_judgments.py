@@ -0,0 +1,77 @@
+import json
+import tracemalloc
+from pathlib import Path
+
+from langchainlaw.classifier import Classifier
+from langchainlaw.judgments import JudgmentCache
+
+MB = 1024 * 1024
+
+
+def test_judgment_cache():
+    cache = JudgmentCache(max_bytes=100)
+    cache.put("a", {"a": 1}, "a", 40)
+    cache.put("b", {"b": 1}, "b", 40)
+    assert cache.get("a") == ({"a": 1}, "a")
+    cache.put("c", {"c": 1}, "c", 40)
+    # b was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size == 80
+    cache.put("huge", {}, "", 1000)
+    assert cache.get("huge") is None
+    assert cache.hits == 2 and cache.misses == 2
+
+
+def long_judgment_classifier(files, tmp_path, split):
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    cf["split_judgment"] = split
+    classifier = Classifier(cf, quiet=True)
+    classifier.load_prompts(files["prompts"])
+    casefile = tmp_path / "long.json"
+    paragraph = "The plaintiff said that the deceased promised her the house. "
+    judgment = {"mnc": "[2020] NSWSC 1", "judgment": paragraph * 40000}
+    with open(casefile, "w") as fh:
+        json.dump(judgment, fh)
+    return classifier, casefile
+
+
+def message_memory(classifier, casefile) -> int:
+    """Peak memory used while building every prompt's messages for a case"""
+    classifier.load_judgment(casefile)
+    tracemalloc.start()
+    messages = [classifier.make_messages(p) for p in classifier.next_prompt()]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(messages) == len(classifier.prompt_names)
+    return peak
+
+
+def test_load_judgment_cached(files, tmp_path):
+    classifier, casefile = long_judgment_classifier(files, tmp_path, False)
+    classifier.load_judgment(casefile)
+    encoded = classifier._prompt_judgment
+    classifier.load_judgment(Path(files["case"]))
+    classifier.load_judgment(casefile)
+    assert classifier._prompt_judgment is encoded
+    assert classifier.judgments.hits == 1
+
+
+def test_message_memory(files, tmp_path):
+    """Benchmark: with a 2.4MB judgment and 7 prompts, concatenating the
+    judgment to each prompt allocates a copy per prompt, while split messages
+    share one"""
+    classifier, casefile = long_judgment_classifier(files, tmp_path, False)
+    joined = message_memory(classifier, casefile)
+    classifier, casefile = long_judgment_classifier(files, tmp_path, True)
+    split = message_memory(classifier, casefile)
+    size = len(classifier._prompt_judgment)
+    assert joined > size * len(classifier.prompt_names)
+    assert split < MB
+    messages = classifier.make_messages(classifier.prompt("dates"))
+    other = classifier.make_messages(classifier.prompt("wills"))
+    assert messages[0] is other[0]
+    # the prompt message is just the questions
+    assert messages[1].content.strip().startswith(classifier.prompt("dates").question)
+    assert len(messages[1].content) < 2000
@@ -0,0 +1,27 @@
+import json
+
+from langchainlaw.loadtest import run_loadtest, format_report
+
+
+def test_loadtest(files, tmp_path):
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    cf["retry_backoff"] = 0
+    cf["loadtest"] = {
+        "seed": 42,
+        "error_rate": 0.1,
+        "malformed_rate": 0.1,
+        "latency": {"type": "uniform", "min": 0, "max": 0.002},
+    }
+    report = run_loadtest(cf, cases=40, concurrency=4, outdir=tmp_path, show=False)
+    assert report["cases"] == 40
+    assert report["prompts"] == 40 * 7
+    assert report["retries"] > 0
+    assert report["faults"]["malformed"] > 0
+    cache = report["cache"]
+    assert cache["correct"] + cache["wrong"] + cache["missing"] == 40 * 7
+    assert 0 < cache["wrong"] <= report["faults"]["malformed"]
+    sheet = report["spreadsheet"]
+    assert sheet["rows"] == 40
+    assert 0 < sheet["correct"] < 40
+    assert "Spreadsheet:" in format_report(report)
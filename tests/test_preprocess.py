@@ -0,0 +1,114 @@
+import json
+import re
+import pytest
+from pathlib import Path
+
+from langchainlaw.cache import Cache
+from langchainlaw.classifier import Classifier
+from langchainlaw.judgments import read_casefile
+from langchainlaw.preprocess import (
+    artifact_paths,
+    compact_text,
+    load_artifact,
+    number_paragraphs,
+    preprocess_casefiles,
+    save_artifact,
+)
+
+
+def test_number_paragraphs():
+    numbered = "JUDGMENT\n1  The plaintiff  applies.\n\n2. The deceased died."
+    assert number_paragraphs(numbered) == [
+        "JUDGMENT",
+        "[1] The plaintiff applies.",
+        "[2] The deceased died.",
+    ]
+    assert number_paragraphs("First.\nSecond.") == ["[1] First.", "[2] Second."]
+    # already preprocessed text is left alone
+    assert number_paragraphs("[7] Seventh.\n[9] Ninth.") == [
+        "[7] Seventh.",
+        "[9] Ninth.",
+    ]
+    # numbers which start sentences aren't paragraph numbers
+    dates = "2 January 2020 the summons was filed.\n2019 was a hard year.\nThen."
+    assert number_paragraphs(dates) == [
+        "[1] 2 January 2020 the summons was filed.",
+        "[2] 2019 was a hard year.",
+        "[3] Then.",
+    ]
+    # a number followed by a month is never rewritten
+    numbered = "1 The plaintiff.\n2 The defendant.\n3 June 2020 was the hearing."
+    assert number_paragraphs(numbered)[2] == "3 June 2020 was the hearing."
+
+
+def test_compact_text(files):
+    with open(files["case"], "r") as fh:
+        judgment = json.load(fh)
+    text = compact_text(judgment)
+    assert len(text) < len(json.dumps(judgment))
+    assert f"mnc: {judgment['mnc']}" in text
+    assert "uri:" not in text
+    assert "\\n" not in text
+    excerpt = {"mnc": "[2010] NSWSC 1", "judgment": "[3] The will.\n[9] Costs."}
+    assert compact_text(excerpt, numbered=True).endswith("\n[3] The will.\n[9] Costs.")
+
+
+def test_artifact(files, tmp_path):
+    cache = Cache(tmp_path / "cache")
+    source, _ = read_casefile(Path(files["case"]))
+    assert load_artifact(cache, "case", source) is None
+    save_artifact(cache, "case", source, "[1] Text.")
+    assert load_artifact(cache, "case", source) == "[1] Text."
+    # a changed casefile or a damaged artifact is rebuilt
+    assert load_artifact(cache, "case", "other") is None
+    # so is one made from a different field
+    assert load_artifact(cache, "case", source, "text") is None
+    text_file, _ = artifact_paths(cache, "case")
+    text_file.write_text("[1] Changed.")
+    assert load_artifact(cache, "case", source) is None
+    # preprocessing a case doesn't put it in the cache
+    assert not cache.exists("case")
+    assert list(cache.case_ids()) == []
+
+
+def test_preprocess_casefiles(files, tmp_path):
+    cache = Cache(tmp_path / "cache")
+    casefiles = [Path(files["case"])]
+    counts = preprocess_casefiles(cache, casefiles)
+    assert counts["built"] == 1
+    assert counts["text_chars"] < counts["json_chars"]
+    assert preprocess_casefiles(cache, casefiles)["reused"] == 1
+
+
+@pytest.fixture
+def mock_config(mock_config):
+    mock_config["preprocess"] = True
+    return mock_config
+
+
+def test_classifier_preprocess(files, mock_config, mock_classifier, tmp_path):
+    classifier = mock_classifier
+    casefile = Path(files["case"])
+    classifier.load_judgment(casefile)
+    text_file, info_file = artifact_paths(classifier.cache, casefile.stem)
+    assert text_file.is_file() and info_file.is_file()
+    text = text_file.read_text()
+    assert text in classifier.make_messages(classifier.prompt("dates"))[0].content
+    # a new classifier reuses the artifact rather than rebuilding it
+    text_file.touch()
+    mtime = text_file.stat().st_mtime_ns
+    other = Classifier(mock_config, quiet=True)
+    other.load_prompts(files["prompts"])
+    other.load_judgment(casefile)
+    assert text_file.stat().st_mtime_ns == mtime
+    assert other._prompt_judgment == classifier._prompt_judgment
+    results = classifier.classify(casefile)
+    assert results["dates"]
+    # an excerpt keeps the judgment's paragraph numbers without renumbering
+    text = "1 The plaintiff applies.\n\n2 The will was dated 1 May 2001.\n\n3 Costs."
+    classifier.judgment = {"mnc": "[2010] NSWSC 1", "judgment": text}
+    prompt = classifier.prompt("dates")
+    prompt.excerpt = 1
+    excerpt = classifier.prompt_judgment(prompt)
+    assert re.search(r"^\[\d+\] ", excerpt, re.M)
+    assert not re.search(r"^\[\d+\] \[\d+\]", excerpt, re.M)
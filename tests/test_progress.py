@@ -0,0 +1,61 @@
+import io
+import urllib.request
+from pathlib import Path
+
+from langchainlaw.progress import Progress, format_seconds, serve_metrics
+
+
+def test_progress():
+    stream = io.StringIO()
+    progress = Progress(total=4, stream=stream)
+    assert progress.eta() is None
+    progress.request({"total_tokens": 100})
+    progress.record("completed")
+    progress.record("cached")
+    progress.record("failed")
+    assert progress.done == 3
+    assert progress.queued == 1
+    requests, tokens, pairs = progress.rates()
+    assert requests > 0 and tokens > 0 and pairs > 0
+    assert progress.eta() > 0
+    assert "3/4 (completed 1, cached 1, failed 1)" in stream.getvalue()
+    metrics = progress.metrics()
+    assert 'langchainlaw_prompts_total{outcome="failed"} 1' in metrics
+    assert "langchainlaw_tokens_total 100" in metrics
+    assert "langchainlaw_queue_depth 1" in metrics
+    assert format_seconds(3725) == "1:02:05"
+
+
+def test_serve_metrics():
+    progress = Progress()
+    progress.record("completed")
+    server = serve_metrics(progress, 0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as r:
+            body = r.read().decode("utf-8")
+    finally:
+        server.shutdown()
+    assert 'langchainlaw_prompts_total{outcome="completed"} 1' in body
+
+
+def test_classifier_progress(files, mock_classifier):
+    classifier = mock_classifier
+    n = len(classifier.prompt_names)
+    classifier.progress = Progress(total=2 * n)
+    case = Path(files["case"])
+    classifier.classify(case)
+    assert classifier.progress.counts["completed"] == n
+    assert classifier.progress.requests == n
+    classifier.classify(case)
+    assert classifier.progress.counts["cached"] == n
+    assert classifier.progress.queued == 0
+    # a response which can't be parsed is a failure, not a result
+    json_prompt = next(
+        p for p in classifier.prompts.values() if p.return_type != "text"
+    )
+    classifier.cache.write(case.stem, json_prompt.name, "not json")
+    classifier.progress = Progress(total=n)
+    classifier.classify(case)
+    assert classifier.progress.counts["failed"] == 1
+    assert classifier.progress.counts["cached"] == n - 1
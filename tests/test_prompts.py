@@ -2,7 +2,13 @@ import json
 import pytest
 import random
 from langchain.schema import HumanMessage
-from langchainlaw.prompts import parse_llm_json, PromptException
+from langchainlaw.prompts import (
+    parse_llm_json,
+    CasePrompt,
+    CasePromptField,
+    PromptException,
+    estimate_tokens,
+)
 from langchainlaw.classifier import Classifier
 
 
@@ -36,3 +42,86 @@ def test_make_prompt(files):
     got_prompt = message.content
 
     assert got_prompt.strip() == expect_dates_prompt.strip()
+
+
+def test_vote():
+    fields = [
+        CasePromptField("successful", "Was it successful?", "yes"),
+        CasePromptField("costs", "Who paid costs?", "defendant"),
+    ]
+    prompt = CasePrompt("outcome", "q", "r", "json", fields, samples=5)
+    assert prompt.agreement_headers == [
+        "outcome:successful:agreement",
+        "outcome:costs:agreement",
+    ]
+    responses = [
+        '{"successful": "yes", "costs": "plaintiff"}',
+        '{"successful": "Yes ", "costs": "defendant"}',
+        "not json at all",
+    ]
+    assert prompt.votes_needed(responses) == 2
+    assert not prompt.majority(responses)
+    responses.append('{"successful": "no", "costs": "defendant"}')
+    assert prompt.votes_needed(responses) == 1
+    responses.append('```json{"successful": "yes", "costs": "defendant"}```')
+    assert prompt.majority(responses)
+    winner, agreement = prompt.vote(responses)
+    assert json.loads(winner) == {"successful": "yes", "costs": "defendant"}
+    assert agreement == {"successful": 0.6, "costs": 0.6}
+
+    text = CasePrompt("notes", "q", "r", "text", [], samples=3)
+    winner, agreement = text.vote(["A", "b", " a"])
+    assert winner == "A"
+    assert agreement == {"notes": 2 / 3}
+
+    # answers which agree but cite different paragraphs
+    winner, agreement = text.vote(["Yes (p12)", "Yes (pp12-13)", "No (p14)"])
+    assert winner == "Yes (p12)"
+    assert agreement == {"notes": 2 / 3}
+    responses = [
+        '{"successful": "Yes (p12)", "costs": "defendant (p20)"}',
+        '{"successful": "Yes (pp12-13)", "costs": "defendant"}',
+        '{"successful": "Yes (p14)", "costs": "plaintiff (p20)"}',
+    ]
+    assert prompt.tally(responses)["successful"] == {"yes": 3}
+    winner, agreement = prompt.vote(responses)
+    assert json.loads(winner)["successful"] == "Yes (p12)"
+    assert agreement == {"successful": 1.0, "costs": 2 / 3}
+
+
+def test_output_limits():
+    fields = [
+        CasePromptField("name", "Name of the party", "Jane Citizen"),
+        CasePromptField("role", "Role of the party", "plaintiff"),
+    ]
+    prompt = CasePrompt("parties", "q", "r", "json_multiple", fields, repeats=2)
+    assert prompt.output_tokens == 2 * estimate_tokens(prompt.mock_response())
+    assert prompt.token_limit == 256
+    prompt.repeats = 50
+    assert prompt.token_limit == prompt.output_tokens * 3
+    prompt.max_tokens = 100
+    assert prompt.token_limit == 100
+    text = CasePrompt("summary", "q", "r", "text", None)
+    assert text.token_limit is None
+    prompt.repeats = 1
+    results = [{"name": "A", "role": "x"}, {"name": "B", "role": "y"}]
+    assert prompt.collimate(results) == ["A", "x"]
+
+
+def test_unclosed_fence():
+    assert parse_llm_json('```json\n{"a": 1}\n') == {"a": 1}
+
+
+def test_collimate_errors():
+    fields = [
+        CasePromptField("name", "Name of the party", "Jane Citizen"),
+        CasePromptField("role", "Role of the party", "plaintiff"),
+    ]
+    prompt = CasePrompt("parties", "q", "r", "json_multiple", fields, repeats=2)
+    assert prompt.collimate(None) == ["", "", "", ""]
+    assert prompt.collimate([{"name": "A", "role": "x"}]) == ["A", "x", "", ""]
+    assert prompt.collimate("error parsing") == ["error parsing", "", "", ""]
+    assert prompt.collimate(prompt.wrap_error("oops")) == ["oops", "", "", ""]
+    single = CasePrompt("dates", "q", "r", "json", fields)
+    assert single.collimate(["bad", "json"]) == ["bad", "json"]
+    assert single.collimate("error parsing") == ["error parsing", ""]
@@ -0,0 +1,155 @@
+import json
+import pytest
+import time
+from pathlib import Path
+from langchain.schema import HumanMessage
+from langchainlaw.classifier import Classifier
+from langchainlaw.prompts import PromptException
+from langchainlaw.providers import (
+    make_provider,
+    LocalProvider,
+    MockProvider,
+    OpenAIProvider,
+    ProviderException,
+    TransientError,
+    DEFAULT_LOCAL_URL,
+)
+
+
+def test_make_provider():
+    openai = make_provider("o", {"model": "gpt-4o", "api_key": "x"})
+    assert type(openai) is OpenAIProvider
+    local = make_provider("l", {"type": "local"})
+    assert type(local) is LocalProvider
+    assert local.llm.openai_api_base == DEFAULT_LOCAL_URL
+    mock = make_provider("m", {"type": "mock"})
+    assert type(mock) is MockProvider
+    with pytest.raises(ProviderException):
+        make_provider("x", {"type": "carrier-pigeon"})
+
+
+def test_mock_provider(mock_classifier):
+    classifier = mock_classifier
+    prompt = classifier.prompt("dates")
+    response = classifier.llm.chat([HumanMessage(content="hi")], prompt)
+    assert response.content == prompt.mock_response()
+
+
+def test_mock_classify(files, mock_classifier):
+    """A non-test run against the mock provider goes through the cache"""
+    classifier = mock_classifier
+    case = Path(files["case"])
+    results = classifier.classify(case)
+    dates = classifier.prompt("dates")
+    assert results["dates"] == dates.parse_response(dates.mock_response())
+    assert classifier.cache.read(case.stem, "dates") == dates.mock_response()
+
+
+def test_prompt_routing(mock_classifier):
+    classifier = mock_classifier
+    prompt = classifier.prompt("dates")
+    assert classifier.provider_for(prompt) is classifier.llm
+    prompt.provider = "openai"
+    assert classifier.provider_for(prompt).name == "openai"
+    prompt.provider = "nonexistent"
+    with pytest.raises(PromptException):
+        classifier.provider_for(prompt)
+
+
+def test_sampling(files, mock_classifier):
+    classifier = mock_classifier
+    prompt = classifier.prompt("dates")
+    prompt.samples = 5
+    calls = []
+    chat = classifier.llm.chat
+
+    def counting_chat(messages, prompt=None, **kwargs):
+        if prompt is not None:
+            calls.append(prompt.name)
+        return chat(messages, prompt, **kwargs)
+
+    classifier.llm.chat = counting_chat
+    case = Path(files["case"])
+    results = classifier.classify(case, prompts=["dates"])
+    # the mock always agrees with itself so three samples make a majority
+    assert calls == ["dates"] * 3
+    assert results["agreement"]["dates"] == {
+        "filing_date": 1.0,
+        "interlocutory": 1.0,
+        "interlocutory_date": 1.0,
+    }
+    samples = json.loads(classifier.cache.read(case.stem, "dates.samples"))
+    assert len(samples) == 3
+    flat = classifier.as_dict(classifier.classify(case))
+    assert flat["dates:filing_date:agreement"] == 1.0
+    assert calls.count("dates") == 3  # the second time dates was cached
+
+
+def test_continuation(files, mock_classifier):
+    classifier = mock_classifier
+    classifier.continuations = 10
+    prompt = classifier.prompt("dates")
+    prompt.max_tokens = 5
+    case = Path(files["case"])
+    results = classifier.classify(case, prompts=["dates"])
+    assert results["dates"] == prompt.parse_response(prompt.mock_response())
+    classifier.continuations = 0
+    truncated = classifier.get_response(case.stem, prompt, no_cache=True)
+    assert truncated == prompt.mock_response()[:20]
+
+
+class PreambleProvider(MockProvider):
+    """Mock which introduces its answer before fencing it"""
+
+    def chat(self, messages, prompt=None, max_tokens=None):
+        response = super().chat(messages, prompt)
+        response.content = f"Here is the JSON:\n```json\n{response.content}\n```"
+        return response
+
+
+def test_answer_after_preamble(mock_classifier):
+    classifier = mock_classifier
+    classifier.llm = PreambleProvider("preamble", {})
+    classifier.judgment = {"mnc": "[2020] NSWSC 1"}
+    prompt = classifier.prompt("dates")
+    response = classifier.get_response("x", prompt, no_cache=True)
+    assert prompt.parse_response(response) == prompt.parse_response(
+        prompt.mock_response()
+    )
+
+
+def test_max_tokens_model():
+    openai = make_provider("o", {"model": "gpt-4o", "api_key": "x"})
+    limited = openai.llm_for(100)
+    assert limited.max_tokens == 100
+    assert openai.llm.max_tokens is None
+    assert openai.llm_for(100) is limited
+
+
+def test_faulty_provider(files, mock_config):
+    faulty = {"type": "faulty", "wraps": {"type": "mock"}, "seed": 1}
+    mock_config["providers"]["faulty"] = dict(faulty, rate_limit_rate=1.0)
+    mock_config["provider"] = "faulty"
+    mock_config["retries"] = 2
+    mock_config["retry_backoff"] = 0
+    classifier = Classifier(mock_config, quiet=True)
+    classifier.load_prompts(files["prompts"])
+    classifier.judgment = {"mnc": "[2020] NSWSC 1"}
+    prompt = classifier.prompt("dates")
+    with pytest.raises(TransientError):
+        classifier.get_response("x", prompt, no_cache=True)
+    assert classifier.stats["retries"] == 2
+    assert classifier.llm.faults["rate_limit"] == 3
+    # each 429 starts a burst of them
+    assert classifier.llm.burst == 2
+
+    malformed = make_provider("m", dict(faulty, malformed_rate=1.0))
+    response = malformed.chat([HumanMessage(content="hi")], prompt).content
+    assert type(prompt.parse_response(response)) is str
+    assert prompt.collimate(prompt.parse_response(response))[0] == (
+        prompt.parse_response(response)
+    )
+    slow = make_provider("s", dict(faulty, latency={"type": "fixed", "seconds": 0.1}))
+    started = time.monotonic()
+    slow.chat([HumanMessage(content="hi")], prompt)
+    assert time.monotonic() - started >= 0.1
@@ -0,0 +1,76 @@
+import pytest
+from pathlib import Path
+from langchainlaw.scheduler import (
+    Scheduler,
+    WorkItem,
+    estimate_tokens,
+    estimate_work,
+    run_schedule,
+)
+
+
+@pytest.fixture
+def mock_config(mock_config):
+    mock_config["providers"]["mock"].update(input_price=2.5, output_price=10)
+    return mock_config
+
+
+def item(case_id, prompt, tokens, cached=False):
+    return WorkItem(case_id, Path(f"{case_id}.json"), prompt, tokens, 0, tokens, cached)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcde") == 2
+
+
+def test_estimate_work(files, mock_classifier):
+    items = estimate_work(mock_classifier, [Path(files["case"])])
+    assert [i.prompt for i in items] == mock_classifier.prompt_names
+    for i in items:
+        assert i.input_tokens > 0 and i.output_tokens > 0 and i.cost > 0
+        assert not i.cached
+
+
+def test_priority_and_budget():
+    items = [item("a", "dates", 10), item("a", "parties", 10), item("b", "dates", 10)]
+    items.append(item("b", "parties", 0, cached=True))
+    scheduler = Scheduler(items, prompt_priority=["parties"], case_priority=["b"])
+    order = [(i.case_id, i.prompt) for i in scheduler.ordered()]
+    assert order == [
+        ("b", "parties"),
+        ("a", "parties"),
+        ("b", "dates"),
+        ("a", "dates"),
+    ]
+    scheduler.max_tokens = 15
+    assert len(scheduler.budgeted()) == 2
+    scheduler.max_tokens = None
+    scheduler.max_cost = 25
+    assert len(scheduler.budgeted()) == 3
+
+
+def test_windows():
+    items = [item("a", "big", 80), item("b", "big", 80), item("c", "small", 20)]
+    scheduler = Scheduler(items, tokens_per_minute=100)
+    windows = scheduler.windows()
+    assert [[i.case_id for i in w] for w in windows] == [["a", "c"], ["b"]]
+    scheduler = Scheduler(items, tokens_per_minute=1000, requests_per_minute=2)
+    assert len(scheduler.windows()) == 2
+
+
+def test_run_schedule(files, mock_classifier):
+    items = estimate_work(mock_classifier, [Path(files["case"])])
+    scheduler = Scheduler(items, prompt_priority=["dates"], max_tokens=1)
+    assert run_schedule(mock_classifier, scheduler.windows()) == {}
+    scheduler.max_tokens = None
+    results = run_schedule(mock_classifier, scheduler.windows())
+    assert set(results["123456789abcdef0"]) == {"file", "mnc"} | set(
+        mock_classifier.prompt_names
+    )
+    # estimating a cached case doesn't count as hits
+    cache = mock_classifier.cache
+    hits = cache.hits
+    items = estimate_work(mock_classifier, [Path(files["case"])])
+    assert all(i.cached for i in items)
+    assert cache.hits == hits
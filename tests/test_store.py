@@ -0,0 +1,46 @@
+import json
+import pytest
+from pathlib import Path
+
+from langchainlaw.classifier import Classifier
+
+pytest.importorskip("pyarrow")
+
+from langchainlaw.store import ResultsStore, read_results  # noqa: E402
+
+
+def test_store(files, tmp_path):
+    with open(files["config"], "r") as fh:
+        cf = json.load(fh)
+    classifier = Classifier(cf, quiet=True)
+    classifier.load_prompts(files["prompts"])
+    headers = classifier.headers
+    results = classifier.classify(Path(files["case"]), test=True)
+    row = dict(zip(headers, classifier.as_columns(results)))
+    root = tmp_path / "store"
+    with ResultsStore(root, headers, run="a", batch_size=2) as store:
+        for _ in range(3):
+            store.append(row)
+    assert len(list((root / "run=a").glob("*.parquet"))) == 2
+    with ResultsStore(root, headers[:3], run="b") as store:
+        store.append(row)
+    table = read_results(root, columns=["run", "file", headers[2]])
+    assert table.num_rows == 4
+    assert table.column_names == ["run", "file", headers[2]]
+    assert sorted(table.column("run").to_pylist()) == ["a", "a", "a", "b"]
+    assert table.column(headers[2]).to_pylist()[0] == row[headers[2]]
+    assert read_results(root, runs=["b"]).num_rows == 1
+    df = read_results(root).to_pandas()
+    assert df[df["run"] == "b"][headers[-1]].isna().all()
+
+
+def test_agreement_column(tmp_path):
+    headers = ["file", "mnc", "dates:filing_date", "dates:filing_date:agreement"]
+    row = {"file": "x.json", "dates:filing_date": ["a"]}
+    row["dates:filing_date:agreement"] = 0.6
+    with ResultsStore(tmp_path, headers, run="r") as store:
+        store.append(row)
+    table = read_results(tmp_path)
+    assert str(table.schema.field("dates:filing_date:agreement").type) == "double"
+    assert table.column("dates:filing_date").to_pylist() == ['["a"]']
+    assert table.column("mnc").to_pylist() == [None]
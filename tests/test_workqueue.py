@@ -0,0 +1,65 @@
+import pytest
+from pathlib import Path
+from openpyxl import load_workbook
+from langchainlaw.workqueue import WorkQueue, Job, make_jobs, work, assemble
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / "queue.sqlite"))
+
+
+def test_claim_and_lease(queue):
+    added = queue.enqueue([Job("a", "dates", "a.json"), Job("b", "dates", "b.json")])
+    assert added == 2
+    assert queue.enqueue([Job("a", "dates", "a.json")]) == 0
+    job = queue.claim("w1")
+    assert job.case_id == "a"
+    queue.complete(job)
+    job = queue.claim("w1", lease=-1)  # lease has already run out
+    assert job.case_id == "b"
+    again = queue.claim("w2")
+    assert again.case_id == "b" and again.attempts == 2
+    assert queue.claim("w3") is None
+    # the first worker has lost its lease and can't change the job
+    assert not queue.complete(job)
+    assert not queue.fail(job, "late", max_attempts=2)
+    assert queue.fail(again, "oops", max_attempts=2)
+    assert not queue.complete(again)
+    assert queue.counts() == {"done": 1, "failed": 1}
+
+
+def test_claim_expired_attempts(queue):
+    queue.enqueue([Job("a", "dates", "a.json")])
+    for _ in range(2):
+        assert queue.claim("w1", lease=-1, max_attempts=2) is not None
+    # the worker died on its last attempt
+    assert queue.claim("w2", max_attempts=2) is None
+    assert queue.counts() == {"failed": 1}
+    (error,) = queue.db.execute("SELECT error FROM jobs").fetchone()
+    assert error == "lease expired on attempt 2"
+
+
+def test_shared_budget(queue):
+    assert queue.reserve_slot(10) == 0
+    assert queue.reserve_slot(10) > 9
+
+
+def test_work_and_assemble(files, queue, mock_classifier, tmp_path):
+    case = Path(files["case"])
+    jobs = make_jobs(mock_classifier, [case], None)
+    assert len(jobs) == len(mock_classifier.prompt_names)
+    queue.enqueue(jobs)
+    # sampling threads share the worker's queue connection
+    mock_classifier.prompt("dates").samples = 3
+    work(mock_classifier, queue, "w1")
+    assert queue.counts() == {"done": len(jobs)}
+    assert mock_classifier.sampled == {}
+    mock_classifier.prompt("dates").samples = 1
+    dates = mock_classifier.prompt("dates")
+    assert mock_classifier.cache.read(case.stem, "dates") == dates.mock_response()
+    output = tmp_path / "results.xlsx"
+    assemble(mock_classifier, queue, str(output))
+    rows = list(load_workbook(output).active.values)
+    assert list(rows[0]) == mock_classifier.headers
+    assert len(rows) == 2